@@ -0,0 +1,94 @@
+"""
+Compares the history files written as pretty-printed lists of paths with
+the compact ones (`compact_history_files`, each directory stored once):
+their size, the time to save and to load them, and the memory the loaded
+history takes now against before, when every entry also kept its path
+expanded, and the share of it saved.
+
+    python3 benchmarks/bench_compact.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sublime  # noqa: E402
+import open_recent  # noqa: E402
+
+FOLDERS = 1000
+FILES_PER_FOLDER = 20
+
+
+def setup(size, compact):
+    packages = tempfile.mkdtemp(prefix='OpenRecentBench')
+    os.makedirs(os.path.join(packages, 'User'))
+    sublime.set_packages_path(packages)
+    conf = sublime.load_settings(open_recent.SETTINGS_FILE)
+    conf.set('compact_history_files', compact)
+    conf.set('max_files', size)
+    conf.set('max_folders', FOLDERS)
+    open_recent.settings = conf
+    folders = ['~/projects/project_%d' % i for i in range(FOLDERS)]
+    # ten files per directory, twenty directories per folder
+    files = ['%s/src/module_%d/file_%d.py' % (
+        folders[i // 200 % FOLDERS], i // 10 % 20, i) for i in range(size)]
+    open_recent.files_hist = open_recent.RecentHistory(files)
+    open_recent.folders_hist = open_recent.RecentHistory(folders)
+    open_recent.folders_info = {
+        folder: {'opened_files': files[i::FOLDERS][:FILES_PER_FOLDER],
+                 'active_file': files[i]}
+        for i, folder in enumerate(folders)}
+    open_recent.history_writer = open_recent.HistoryWriter()
+    return packages
+
+
+def measure(size, compact):
+    packages = setup(size, compact)
+    writer = open_recent.history_writer
+    start = time.perf_counter()
+    writer._save_folders()
+    writer._save_folders_info()
+    writer._save_files()
+    save = (time.perf_counter() - start) * 1000
+    file_size = sum(
+        os.path.getsize(open_recent.history_path(name))
+        for name in (open_recent.RECENT_FOLDERS, open_recent.FOLDERS_INFO,
+                     open_recent.RECENT_FILES)) / 1024
+
+    start = time.perf_counter()
+    open_recent.load_history_files()
+    load = (time.perf_counter() - start) * 1000
+
+    open_recent.files_hist = open_recent.folders_hist = None
+    open_recent.folders_info = {}
+    tracemalloc.start()
+    open_recent.load_history_files()
+    now = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    # what the entries held before: an expanded path each on top
+    expanded = [open_recent.HOME + path[1:] for path in open_recent.files_hist]
+    before = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    tracemalloc.stop()
+    assert len(open_recent.files_hist) == len(expanded) == size
+    shutil.rmtree(packages)
+    return file_size, save, load, before, now
+
+
+def main():
+    print('%8s %10s %10s %9s %9s %9s %9s %9s %9s %9s' % (
+        'entries', 'json KB', 'compact KB', 'json save', 'cmp save',
+        'json load', 'cmp load', 'before MB', 'now MB', 'saved %'))
+    for size in (1000, 10000, 100000):
+        plain = measure(size, False)
+        compact = measure(size, True)
+        before, now = compact[3], compact[4]
+        print('%8d %10.0f %10.0f %9.1f %9.1f %9.1f %9.1f %9.1f %9.1f %9.0f' % (
+            size, plain[0], compact[0], plain[1], compact[1], plain[2],
+            compact[2], before, now, (before - now) / before * 100))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Measures the cost of a touch, which updates the frecency ranking, at
+growing history sizes, next to re-sorting the whole history by score as a
+ranking computed at `run` time would. A touch should stay roughly flat as
+the history grows, while the re-sort grows with it.
+
+    python3 benchmarks/bench_frecency.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from open_recent import RecentHistory  # noqa: E402
+
+TOUCHES = 20000
+SORTS = 20
+
+
+def run(size):
+    paths = ['/home/user/project/src/module_%d/file_%d.py' % (i % 97, i)
+             for i in range(size)]
+    hist = RecentHistory(paths)
+    hist.ranked()
+    rnd = random.Random(size)
+    # a few paths are touched much more often than the rest
+    touched = [paths[min(int(rnd.paretovariate(1.2)) - 1, size - 1)]
+               if rnd.random() < 0.7 else rnd.choice(paths)
+               for _ in range(TOUCHES)]
+    now = time.time()
+
+    start = time.perf_counter()
+    for i, path in enumerate(touched):
+        hist.touch(path, now + i)
+    touch_us = (time.perf_counter() - start) / TOUCHES * 1e6
+
+    entries = hist._items
+    start = time.perf_counter()
+    for _ in range(SORTS):
+        sorted(entries, key=lambda path: -entries[path].score)
+    sort_ms = (time.perf_counter() - start) / SORTS * 1000
+
+    assert hist.ranked() == sorted(entries, key=lambda path: (
+        -entries[path].score, path))
+    assert len(hist.ranked()) == size
+    return touch_us, sort_ms
+
+
+def main():
+    print('%8s %14s %16s' % ('entries', 'touch us', 'full sort ms'))
+    for size in (1000, 10000, 50000, 100000):
+        touch_us, sort_ms = run(size)
+        print('%8d %14.2f %16.2f' % (size, touch_us, sort_ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Compares the cost of saving the history after a single file was touched,
+with the "json" storage (the _save_* writers rewrite the history files) and
+the "journal" storage (one record appended, compacted every
+journal_compact_threshold records), and the cost of replaying the journal
+when loading.
+
+    python3 benchmarks/bench_journal.py
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sublime  # noqa: E402
+import open_recent  # noqa: E402
+
+SAVES = 300
+COMPACT_THRESHOLD = 1000
+
+
+def setup(size, storage):
+    packages = tempfile.mkdtemp(prefix='OpenRecentBench')
+    os.makedirs(os.path.join(packages, 'User'))
+    sublime.set_packages_path(packages)
+    conf = sublime.load_settings(open_recent.SETTINGS_FILE)
+    conf.set('history_storage', storage)
+    conf.set('journal_compact_threshold', COMPACT_THRESHOLD)
+    open_recent.settings = conf
+    open_recent.files_hist = open_recent.RecentHistory(
+        ['/home/user/project/src/module_%d/file_%d.py' % (i % 97, i)
+         for i in range(size)])
+    open_recent.folders_hist = open_recent.RecentHistory(
+        ['/home/user/project_%d' % i for i in range(30)])
+    open_recent.folders_info = {
+        folder: {'opened_files': list(open_recent.files_hist)[:20],
+                 'active_file': ''}
+        for folder in open_recent.folders_hist}
+    open_recent.history_writer = writer = open_recent.HistoryWriter()
+    open_recent.history_journal = open_recent.HistoryJournal()
+    open_recent.history_journal.reset_saved_info()
+    writer.dirty = True
+    writer.flush()
+    return packages, writer
+
+
+def measure(size, storage):
+    packages, writer = setup(size, storage)
+    paths = list(open_recent.files_hist)
+    rnd = random.Random(size)
+    start = time.perf_counter()
+    for _ in range(SAVES):
+        open_recent.files_hist.touch(rnd.choice(paths))
+        writer.dirty = True
+        writer.flush()
+    elapsed = (time.perf_counter() - start) / SAVES * 1000
+
+    load_start = time.perf_counter()
+    open_recent.load_history_files()
+    load = (time.perf_counter() - load_start) * 1000
+    shutil.rmtree(packages)
+    return elapsed, load
+
+
+def main():
+    print('%8s %16s %16s %16s %16s' % (
+        'entries', 'json ms/save', 'journal ms/save', 'json load ms',
+        'journal load ms'))
+    for size in (100, 1000, 10000, 50000):
+        json_save, json_load = measure(size, 'json')
+        journal_save, journal_load = measure(size, 'journal')
+        print('%8d %16.3f %16.3f %16.1f %16.1f' % (
+            size, json_save, journal_save, json_load, journal_load))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Compares the list based history used before RecentHistory with the
+OrderedDict backed one, for the pattern FoldersFilesListener runs on every
+activation: touch every file open in the window, then trim the history.
+
+    python3 benchmarks/bench_recency.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from open_recent import RecentHistory  # noqa: E402
+
+VIEWS = 150
+ACTIVATIONS = 200
+
+
+def list_activation(hist, files, max_len):
+    for file in files:
+        if file in hist:
+            hist.remove(file)
+        hist.append(file)
+    while len(hist) > max_len:
+        hist.pop(0)
+
+
+def store_activation(hist, files, max_len):
+    for file in files:
+        hist.touch(file)
+    hist.trim(max_len)
+
+
+def run(size):
+    paths = ['/home/user/project/src/module_%d/file_%d.py' % (i % 97, i)
+             for i in range(size)]
+    rnd = random.Random(size)
+    windows = [rnd.sample(paths, VIEWS) for _ in range(ACTIVATIONS)]
+    results = {}
+    for name, make, activate in (
+            ('list', lambda: list(paths), list_activation),
+            ('RecentHistory', lambda: RecentHistory(paths), store_activation)):
+        hist = make()
+        start = time.perf_counter()
+        for files in windows:
+            activate(hist, files, size)
+        elapsed = time.perf_counter() - start
+        results[name] = elapsed / ACTIVATIONS * 1000
+    return results
+
+
+def main():
+    print('%8s %16s %16s %8s' % ('entries', 'list ms/act', 'store ms/act', 'speedup'))
+    for size in (1000, 10000, 50000, 100000):
+        res = run(size)
+        print('%8d %16.3f %16.3f %7.0fx' % (
+            size, res['list'], res['RecentHistory'],
+            res['list'] / res['RecentHistory']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Measures the open_recent_search index: build time and memory, then query
+latency next to a linear scan of all paths, for 10k to 100k paths.
+
+    python3 benchmarks/bench_search.py
+"""
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import open_recent  # noqa: E402
+
+QUERIES = ['controller', 'user model', 'src test', 'ut', 'zzzq', 'api v2 handler']
+WORDS = ['src', 'lib', 'test', 'api', 'v2', 'user', 'model', 'view',
+         'controller', 'handler', 'utils', 'core', 'docs', 'config']
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'ta', 'vo', 'shi', 'pe', 'dra']
+# the usual names, plus a few hundred less common ones
+WORDS += sorted(set(a + b + c for a in SYLLABLES for b in SYLLABLES
+                    for c in SYLLABLES))[::3]
+
+
+def make_paths(count):
+    rnd = random.Random(count)
+    paths = set()
+    while len(paths) < count:
+        parts = ['~', 'projects', 'project_%d' % rnd.randrange(50)]
+        parts += rnd.sample(WORDS, rnd.randrange(1, 4))
+        parts.append('%s_%s_%d.py' % (rnd.choice(WORDS), rnd.choice(WORDS),
+                                      rnd.randrange(100)))
+        paths.add('/'.join(parts))
+    return list(paths)
+
+
+def linear_search(paths, query):
+    words = query.lower().split()
+    return [path for path in paths if all(w in path.lower() for w in words)]
+
+
+def run(count):
+    paths = make_paths(count)
+    index = open_recent.TrigramIndex()
+    hist = open_recent.RecentHistory(paths)
+    index.attach('files', hist)
+
+    start = time.perf_counter()
+    index.build()
+    build_ms = (time.perf_counter() - start) * 1000
+
+    index = open_recent.TrigramIndex()
+    index.attach('files', hist)
+    tracemalloc.start()
+    index.build()
+    memory = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    tracemalloc.stop()
+
+    print('%d paths: build %.0f ms, %.1f MB' % (count, build_ms, memory))
+    for query in QUERIES:
+        start = time.perf_counter()
+        for _ in range(10):
+            results = index.search(query)
+        indexed_ms = (time.perf_counter() - start) * 100
+        start = time.perf_counter()
+        expected = linear_search(paths, query)
+        linear_ms = (time.perf_counter() - start) * 1000
+        assert len(results) == min(100, len(expected))
+        print('  %-16s %6d matches %8.2f ms indexed %8.2f ms linear' % (
+            repr(query), len(expected), indexed_ms, linear_ms))
+
+    start = time.perf_counter()
+    for i in range(1000):
+        hist.touch('~/new/file_%d.py' % i)
+    hist.trim(count)
+    print('  1000 touches + trim with incremental index updates: %.1f ms' % (
+        (time.perf_counter() - start) * 1000))
+
+
+def main():
+    open_recent.DEBUG_ON = False
+    for count in (10000, 100000):
+        run(count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Measures latency and peak memory of reading the folder and file histories
+from synthetic Sublime session files of 1 to 50 MB, with the full decode
+(SessionCache.decode) and the partial one (extract_session_histories).
+The peak is the growth of the resident set of a fresh process doing the
+read, as tracemalloc doesn't see the memory-mapped session file.
+
+    python3 benchmarks/bench_session.py
+"""
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import open_recent  # noqa: E402
+
+HISTORY = 100
+
+
+def make_session(path, size_mb):
+    """Writes a session whose windows' buffers make it about size_mb MB."""
+    rnd = random.Random(size_mb)
+    target = size_mb * 1024 * 1024
+    line = 'x = "some buffer content with \\"quotes\\" and {braces}"\n' * 20
+    windows = []
+    size = 0
+    while size < target:
+        buffers = []
+        for i in range(20):
+            buffers.append({
+                'file': '/home/user/project/file_%d.py' % rnd.randint(0, 10**6),
+                'contents': line,
+                'settings': {'buffer_size': len(line), 'encoding': 'UTF-8',
+                             'line_ending': 'Unix'}
+            })
+            size += len(line) + 150
+        windows.append({'buffers': buffers, 'groups': [{'sheets': []}],
+                        'settings': {'side_bar_visible': True}})
+    session = {
+        'folder_history': ['/home/user/project_%d' % i for i in range(HISTORY)],
+        'last_version': 4169,
+        'settings': {
+            'new_window_settings': {
+                'console': {'height': 0.0},
+                'file_history': ['/home/user/project/file_%d.py' % i
+                                 for i in range(HISTORY)],
+                'find_state': {'find_history': ['{', '"', '[']},
+            }
+        },
+        'windows': windows,
+        'workspaces': {'recent_workspaces': []}
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(session, f, indent='\t', sort_keys=True)
+
+
+def reader(name):
+    func = open_recent
+    for attr in name.split('.'):
+        func = getattr(func, attr)
+    return func
+
+
+def peak_rss():
+    """Returns the peak resident set of this process in KB."""
+    # on Linux, ru_maxrss keeps the parent's peak across exec
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # in bytes on macOS, in KB elsewhere
+    return peak / 1024 if sys.platform == 'darwin' else peak
+
+
+def read_peak(name, path, conn):
+    """Sends the KB the peak resident set grew by while reading path."""
+    before = peak_rss()
+    reader(name)(path)
+    conn.send(peak_rss() - before)
+
+
+def measure(name, path):
+    start = time.perf_counter()
+    data = reader(name)(path)
+    elapsed = (time.perf_counter() - start) * 1000
+    assert len(data['folders']) == HISTORY and len(data['files']) == HISTORY
+    # spawned, so that neither this process' peak nor earlier reads count
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=read_peak, args=(name, path, sender))
+    process.start()
+    peak = receiver.recv()
+    process.join()
+    return elapsed, peak
+
+
+def main():
+    print('%6s %14s %14s %16s %16s' % (
+        'MB', 'full ms', 'partial ms', 'full peak KB', 'partial peak KB'))
+    tmp_dir = tempfile.mkdtemp(prefix='OpenRecentBench')
+    for size_mb in (1, 5, 10, 25, 50):
+        path = os.path.join(tmp_dir, 'Session_%d.sublime_session' % size_mb)
+        make_session(path, size_mb)
+        full = measure('SessionCache.decode', path)
+        partial = measure('extract_session_histories', path)
+        print('%6d %14.1f %14.1f %16.0f %16.0f' % (
+            size_mb, full[0], partial[0], full[1], partial[1]))
+        os.remove(path)
+    os.rmdir(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,354 @@
+"""
+Headless benchmark suite: loads open_recent.py against the stand-in
+sublime module in this folder and reports the throughput and latency of
+the listeners, persistence, session reading and every command, for
+histories of 100 to 100k entries.
+
+    python3 benchmarks/run_suite.py                 # the full suite
+    python3 benchmarks/run_suite.py --quick         # up to 10k entries
+    python3 benchmarks/run_suite.py --instrumented  # plus open_recent_stats
+
+The listener workload spreads thousands of activations, loads, saves and
+closes over many windows of real (empty) files; the session workload reads
+synthetic session files of up to 50 MB.
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, ROOT)
+
+import sublime  # noqa: E402
+import open_recent  # noqa: E402
+from bench_session import make_session  # noqa: E402
+
+WINDOWS = 20
+VIEWS_PER_WINDOW = 50
+ACTIVATIONS = 5000
+
+
+class Results():
+    def __init__(self):
+        self.rows = []
+
+    def add(self, workload, size, latencies):
+        latencies = sorted(latencies)
+        total = sum(latencies)
+        row = (workload, size, len(latencies),
+               len(latencies) / total if total else float('inf'),
+               latencies[len(latencies) // 2] * 1000,
+               latencies[int(len(latencies) * 0.99)] * 1000)
+        self.rows.append(row)
+        print('%-36s %8s %7d %12.0f %10.3f %10.3f' % row)
+
+    @staticmethod
+    def header():
+        print('%-36s %8s %7s %12s %10s %10s' % (
+            'workload', 'size', 'ops', 'ops/s', 'p50 ms', 'p99 ms'))
+
+
+def timed(func, repeat, before=None):
+    """Returns the durations of repeat calls of func, in seconds."""
+    latencies = []
+    for _ in range(repeat):
+        if before:
+            before()
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def idle():
+    """Runs what Sublime would run on its threads between user actions."""
+    sublime.run_timeouts()
+
+
+def settle():
+    """Waits for the background path checks, then runs their callbacks."""
+    while open_recent.path_checker.pending or any(
+            thread.name == 'OpenRecent path check'
+            for thread in threading.enumerate()):
+        time.sleep(0.01)
+    time.sleep(0.05)
+    idle()
+
+
+class Workspace():
+    """A Packages folder, history files of `size` entries and a session."""
+
+    def __init__(self, size, instrumented):
+        self.size = size
+        self.dir = tempfile.mkdtemp(prefix='OpenRecentSuite')
+        packages = os.path.join(self.dir, 'Packages')
+        os.makedirs(os.path.join(packages, 'User'))
+        os.makedirs(os.path.join(self.dir, 'Local'))
+        sublime.set_packages_path(packages)
+        sublime.reset_windows()
+        del sublime._timeouts[:]
+
+        conf = sublime.load_settings(open_recent.SETTINGS_FILE)
+        conf.set('max_files', size)
+        conf.set('max_folders', size)
+        conf.set('save_delay', 0)
+        conf.set('session_poll_interval', 0)
+        conf.set('history_storage', 'json')
+        conf.set('instrumentation', instrumented)
+        self.settings = conf
+
+        # the folders exist, so that sanitize_folders keeps them
+        projects = os.path.join(self.dir, 'projects')
+        self.folders = [os.path.join(projects, 'project_%d' % i)
+                        for i in range(size)]
+        for folder in self.folders:
+            os.makedirs(folder)
+        self.files = [os.path.join(self.folders[i % 50], 'src',
+                                   'module_%d' % (i % 97), 'file_%d.py' % i)
+                      for i in range(size)]
+        self.write_history(open_recent.RECENT_FILES, self.files)
+        self.write_history(open_recent.RECENT_FOLDERS, self.folders)
+        self.write_history(open_recent.FOLDERS_INFO, {
+            folder: {'opened_files': self.files[i::max(1, size // 20)][:20],
+                     'active_file': self.files[i]}
+            for i, folder in enumerate(self.folders[:1000])})
+
+        self.session = os.path.join(self.dir, 'Local',
+                                    'Session.sublime_session')
+        make_session(self.session, 1)
+
+        open_recent.search_index = open_recent.TrigramIndex()
+        open_recent.tracked_windows.clear()
+        open_recent.tracked_views.clear()
+        open_recent.window_index.labels.clear()
+        open_recent.window_index.view_windows.clear()
+        open_recent.session_cache.key = None
+        open_recent.session_cache.data = None
+        # loads the new history files, as after a restart
+        loader = open_recent.history_loader
+        loader.loaded = False
+        loader.replayed = 0
+        start = time.perf_counter()
+        open_recent.plugin_loaded()
+        self.plugin_loaded_time = time.perf_counter() - start
+        idle()
+        self.ready_time = loader.ready_time
+        settle()
+
+    @staticmethod
+    def write_history(name, data):
+        with open(open_recent.history_path(name), 'w') as f:
+            f.write(sublime.encode_value(data, True))
+
+    def close(self):
+        shutil.rmtree(self.dir)
+
+
+def bench_persistence(results, ws):
+    size = ws.size
+    results.add('plugin_loaded', size, [ws.plugin_loaded_time])
+    results.add('history ready after plugin_loaded', size, [ws.ready_time])
+    results.add('load_history_files', size, timed(
+        open_recent.load_history_files, 5, before=settle))
+    settle()
+    rnd = random.Random(size)
+    writer = open_recent.history_writer
+
+    def touch():
+        with open_recent.history_lock:
+            open_recent.files_hist.touch(rnd.choice(ws.files))
+        writer.dirty = True
+
+    results.add('flush (json)', size, timed(writer.flush, 30, before=touch))
+    ws.settings.set('history_storage', 'journal')
+    open_recent.history_journal.reset_saved_info()
+    results.add('flush (journal)', size, timed(writer.flush, 30, before=touch))
+    ws.settings.set('history_storage', 'json')
+    touch()
+    writer.flush()
+
+
+def bench_listeners(results, ws):
+    size = ws.size
+    rnd = random.Random(size)
+    files_dir = os.path.join(ws.dir, 'files')
+    windows = []
+    for w in range(WINDOWS):
+        folder = os.path.join(files_dir, 'project_%d' % w)
+        os.makedirs(folder)
+        window = sublime.Window([folder])
+        for v in range(VIEWS_PER_WINDOW):
+            path = os.path.join(folder, 'file_%d.py' % v)
+            open(path, 'w').close()
+            window.open_file(path)
+        windows.append(window)
+    views = [view for window in windows for view in window.views()]
+    listener = open_recent.FoldersFilesListener
+
+    for incremental in (True, False):
+        ws.settings.set('incremental_updates', incremental)
+        open_recent.tracked_windows.clear()
+        open_recent.tracked_views.clear()
+        mode = 'incremental' if incremental else 'full scan'
+        picks = [rnd.choice(views) for _ in range(ACTIVATIONS)]
+        latencies = []
+        for i, view in enumerate(picks):
+            start = time.perf_counter()
+            listener(view).on_activated_async()
+            latencies.append(time.perf_counter() - start)
+            if i % 500 == 0:
+                idle()
+        results.add('on_activated_async (%s)' % mode, size, latencies)
+        idle()
+
+    ws.settings.set('incremental_updates', True)
+    picks = [rnd.choice(views) for _ in range(1000)]
+    results.add('on_deactivated_async', size, timed(
+        lambda: listener(picks.pop()).on_deactivated_async(), 1000))
+    picks = [rnd.choice(views) for _ in range(1000)]
+    results.add('on_post_save_async', size, timed(
+        lambda: listener(picks.pop()).on_post_save_async(), 1000))
+    idle()
+
+    new_views = []
+
+    def load():
+        window = rnd.choice(windows)
+        folder = window.folders()[0]
+        path = os.path.join(folder, 'new_%d.py' % len(new_views))
+        open(path, 'w').close()
+        view = window.open_file(path)
+        new_views.append(view)
+        listener(view).on_load_async()
+
+    results.add('on_load_async', size, timed(load, 500))
+    idle()
+
+    def close():
+        view = new_views.pop()
+        listener(view).on_pre_close()
+        view.close()
+        listener(view).on_close()
+
+    results.add('on_pre_close + on_close', size, timed(close, 500))
+    idle()
+
+
+def bench_commands(results, ws):
+    size = ws.size
+    window = sublime.Window([])
+    for i in range(20):
+        window.open_file(open_recent.expand_path(ws.files[i]))
+    for i in range(10):
+        other = sublime.Window([])
+        for j in range(100):
+            other.open_file('/elsewhere/window_%d/file_%d.py' % (i, j))
+    window.bring_to_front()
+    rnd = random.Random(size)
+
+    def run(name, command, repeat=20, before=idle, **kwargs):
+        results.add(name, size, timed(
+            lambda: command(window).run(**kwargs), repeat, before=before))
+
+    def change():
+        with open_recent.history_lock:
+            open_recent.files_hist.touch(rnd.choice(ws.files))
+            open_recent.folders_hist.touch(rnd.choice(ws.folders))
+
+    run('open_recent_folder', open_recent.OpenRecentFolderCommand)
+    run('remove_recent_folder', open_recent.RemoveRecentFolderCommand)
+    run('open_recent_files', open_recent.OpenRecentFilesCommand)
+    run('open_recent_files (after change)',
+        open_recent.OpenRecentFilesCommand, before=change)
+    ws.settings.set('merge_session_history', True)
+    run('open_recent_files (merged)', open_recent.OpenRecentFilesCommand,
+        before=change)
+    ws.settings.set('merge_session_history', False)
+
+    command = open_recent.OpenRecentFilesCommand(window)
+    command.run()
+    on_highlight = window.quick_panel[2]
+    results.add('open_recent_files preview', size, timed(
+        lambda: on_highlight(rnd.randrange(len(command.files))), 200))
+
+    open_recent.session_cache.refresh()
+    idle()
+    run('open_folder_history', open_recent.OpenFolderHistoryCommand)
+    run('open_file_history', open_recent.OpenFileHistoryCommand)
+
+    search = open_recent.OpenRecentSearchCommand(window)
+    start = time.perf_counter()
+    search.input({})
+    idle()
+    results.add('open_recent_search input + index build', size,
+                [time.perf_counter() - start])
+    for query in ('file_1', 'module_3 py', 'project_7 src file_42'):
+        results.add('open_recent_search %r' % query, size, timed(
+            lambda: search.run(query), 20))
+
+    run('move_to_window', open_recent.MoveToWindowCommand)
+    views = window.views()
+    window.focus_view(views[0])
+    results.add('move_to_new_window', size, timed(
+        lambda: open_recent.MoveToNewWindowCommand(window).run(), 1))
+    window.bring_to_front()
+    idle()
+    with contextlib.redirect_stdout(io.StringIO()):
+        run('open_recent_stats', open_recent.OpenRecentStatsCommand,
+            repeat=5)
+
+
+def bench_session(results, session_sizes):
+    tmp_dir = tempfile.mkdtemp(prefix='OpenRecentSuite')
+    cache = open_recent.SessionCache()
+    for size_mb in session_sizes:
+        path = os.path.join(tmp_dir, 'Session_%d.sublime_session' % size_mb)
+        make_session(path, size_mb)
+
+        def cold():
+            cache.key = None
+
+        results.add('session read (changed)', '%d MB' % size_mb,
+                    timed(lambda: cache.get(path), 5, before=cold))
+        results.add('session read (unchanged)', '%d MB' % size_mb,
+                    timed(lambda: cache.get(path), 200))
+        os.remove(path)
+    os.rmdir(tmp_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--quick', action='store_true',
+                        help='histories of up to 10k entries only')
+    parser.add_argument('--instrumented', action='store_true',
+                        help='collect instrumentation, print open_recent_stats')
+    args = parser.parse_args()
+    sizes = (100, 1000, 10000) if args.quick else (100, 1000, 10000, 100000)
+    session_sizes = (1, 5) if args.quick else (1, 10, 50)
+
+    results = Results()
+    Results.header()
+    for size in sizes:
+        ws = Workspace(size, args.instrumented)
+        try:
+            bench_persistence(results, ws)
+            bench_listeners(results, ws)
+            bench_commands(results, ws)
+        finally:
+            open_recent.plugin_unloaded()
+            ws.close()
+    bench_session(results, session_sizes)
+    if args.instrumented:
+        print()
+        print(open_recent.instruments.report())
+
+
+if __name__ == '__main__':
+    main()
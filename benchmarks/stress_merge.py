@@ -0,0 +1,97 @@
+"""
+Runs several processes that share one Packages/User folder with
+`merge_on_save` set. Each one repeatedly opens new files, removes one it
+opened earlier and saves. Afterwards, every file still open must be in the
+saved history, no removed file may have come back, and the time each save
+held the history lock is reported.
+
+    python3 benchmarks/stress_merge.py
+"""
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WRITERS = 6
+ROUNDS = 40
+FILES_PER_ROUND = 5
+
+
+def writer(packages, number, results):
+    sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+    sys.path.insert(1, ROOT)
+    import sublime
+    import open_recent
+
+    sublime.set_packages_path(packages)
+    conf = sublime.load_settings(open_recent.SETTINGS_FILE)
+    conf.set('merge_on_save', True)
+    conf.set('max_files', 100000)
+    conf.set('max_folders', 100000)
+    open_recent.DEBUG_ON = False
+    open_recent.settings = conf
+    open_recent.load_history_files()
+
+    kept, removed, held = [], [], []
+    for round_number in range(ROUNDS):
+        with open_recent.history_lock:
+            for i in range(FILES_PER_ROUND):
+                path = '/writer_%d/round_%d/file_%d.py' % (
+                    number, round_number, i)
+                open_recent.files_hist.touch(path)
+                kept.append(path)
+            open_recent.folders_hist.touch('/writer_%d/folder_%d' % (
+                number, round_number))
+            if round_number % 4 == 3:
+                path = kept.pop(0)
+                open_recent.files_hist.remove(path)
+                removed.append(path)
+        open_recent.history_writer.dirty = True
+        open_recent.history_writer.flush()
+        held.append(open_recent.history_file_lock.held * 1000)
+    results.put((kept, removed, held))
+
+
+def main():
+    packages = tempfile.mkdtemp(prefix='OpenRecentStress')
+    os.makedirs(os.path.join(packages, 'User'))
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=writer,
+                                         args=(packages, n, results))
+                 for n in range(WRITERS)]
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+    sys.path.insert(1, ROOT)
+    import sublime
+    import open_recent
+    sublime.set_packages_path(packages)
+    with open(open_recent.history_path(open_recent.RECENT_FILES)) as f:
+        saved = set(open_recent.unpack_history(sublime.decode_value(f.read())))
+    with open(open_recent.history_path(open_recent.RECENT_FOLDERS)) as f:
+        folders = set(open_recent.unpack_history(
+            sublime.decode_value(f.read())))
+    shutil.rmtree(packages)
+
+    kept = [path for outcome in outcomes for path in outcome[0]]
+    removed = [path for outcome in outcomes for path in outcome[1]]
+    held = sorted(ms for outcome in outcomes for ms in outcome[2])
+    lost = [path for path in kept if path not in saved]
+    revived = [path for path in removed if path in saved]
+    print('%d writers x %d saves: %d files kept, %d removed, %d folders' % (
+        WRITERS, ROUNDS, len(kept), len(removed), len(folders)))
+    print('lost: %d, revived: %d' % (len(lost), len(revived)))
+    print('lock held: p50 %.2f ms, p99 %.2f ms, max %.2f ms' % (
+        held[len(held) // 2], held[int(len(held) * 0.99)], held[-1]))
+    assert not lost and not revived
+    assert len(folders) == WRITERS * ROUNDS
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,368 @@
+"""
+Stand-in for Sublime's `sublime` module, so open_recent.py can be imported
+and measured outside the editor. Windows and views only keep what the
+plugin asks of them, nothing is drawn, and callbacks passed to
+set_timeout/set_timeout_async are queued until run_timeouts() is called.
+"""
+import itertools
+import json
+import os
+import re
+import tempfile
+
+TRANSIENT = 4
+HIDDEN = 128
+PERSISTENT = 16
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_packages_path = os.path.join(tempfile.gettempdir(), 'OpenRecentBench', 'Packages')
+_ids = itertools.count(1)
+
+
+def platform():
+    return 'linux'
+
+
+def packages_path():
+    return _packages_path
+
+
+def set_packages_path(path):
+    global _packages_path
+    _packages_path = path
+
+
+# Sublime's JSON allows comments and trailing commas
+_COMMENT = re.compile(r'("(?:\\.|[^"\\])*")|//[^\n]*|/\*.*?\*/', re.DOTALL)
+_TRAILING_COMMA = re.compile(r',(\s*[}\]])')
+
+
+def decode_value(data):
+    try:
+        return json.loads(data)
+    except ValueError:
+        pass
+    data = _COMMENT.sub(lambda m: m.group(1) or '', data)
+    return json.loads(_TRAILING_COMMA.sub(r'\1', data))
+
+
+def encode_value(value, pretty=False):
+    if pretty:
+        return json.dumps(value, indent=4)
+    return json.dumps(value)
+
+
+def message_dialog(msg):
+    print('message_dialog: %s' % msg)
+
+
+def ok_cancel_dialog(msg, ok_title=''):
+    return True
+
+
+def status_message(msg):
+    pass
+
+
+class Settings():
+    def __init__(self, data=None):
+        self._data = dict(data or {})
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def set(self, key, value):
+        self._data[key] = value
+
+    def add_on_change(self, tag, callback):
+        pass
+
+    def clear_on_change(self, tag):
+        pass
+
+
+_settings = {}
+
+
+def load_settings(name):
+    """Returns the settings, starting from the package's defaults if any."""
+    if name not in _settings:
+        data = {}
+        path = os.path.join(ROOT, name)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                data = decode_value(f.read())
+        _settings[name] = Settings(data)
+    return _settings[name]
+
+
+_timeouts = []
+
+
+def set_timeout(callback, delay=0):
+    _timeouts.append(callback)
+
+
+def set_timeout_async(callback, delay=0):
+    _timeouts.append(callback)
+
+
+def run_timeouts():
+    """Runs the scheduled callbacks, including the ones they schedule."""
+    while _timeouts:
+        _timeouts.pop(0)()
+
+
+class Region():
+    def __init__(self, a, b=None):
+        self.a = a
+        self.b = a if b is None else b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def __eq__(self, other):
+        return isinstance(other, Region) and \
+            (self.a, self.b) == (other.a, other.b)
+
+    def __repr__(self):
+        return 'Region(%d, %d)' % (self.a, self.b)
+
+
+class Selection():
+    def __init__(self):
+        self._regions = [Region(0)]
+
+    def clear(self):
+        self._regions = []
+
+    def add(self, region):
+        self._regions.append(region)
+
+    def __iter__(self):
+        return iter(self._regions)
+
+    def __len__(self):
+        return len(self._regions)
+
+    def __getitem__(self, index):
+        return self._regions[index]
+
+
+class View():
+    def __init__(self, window, file_name=None):
+        self._id = next(_ids)
+        self._window = window
+        self._file_name = file_name
+        self._name = ''
+        self._dirty = False
+        self._scratch = False
+        self._sel = Selection()
+        self._regions = {}
+        self._viewport = (0.0, 0.0)
+        self._settings = Settings()
+        self.text = ''
+
+    def id(self):
+        return self._id
+
+    def file_name(self):
+        return self._file_name
+
+    def name(self):
+        return self._name
+
+    def set_name(self, name):
+        self._name = name
+
+    def window(self):
+        return self._window
+
+    def is_loading(self):
+        return False
+
+    def is_dirty(self):
+        return self._dirty
+
+    def is_scratch(self):
+        return self._scratch
+
+    def set_scratch(self, scratch):
+        self._scratch = scratch
+
+    def settings(self):
+        return self._settings
+
+    def sel(self):
+        return self._sel
+
+    def get_regions(self, key):
+        return list(self._regions.get(key, []))
+
+    def add_regions(self, key, regions, *args, **kwargs):
+        self._regions[key] = list(regions)
+
+    def erase_regions(self, key):
+        self._regions.pop(key, None)
+
+    def viewport_position(self):
+        return self._viewport
+
+    def set_viewport_position(self, position, animate=True):
+        self._viewport = tuple(position)
+
+    def run_command(self, cmd, args=None):
+        if cmd == 'append':
+            self.text += args['characters']
+
+    def close(self):
+        if self._window:
+            self._window._close_view(self)
+        return True
+
+    def __eq__(self, other):
+        return isinstance(other, View) and other._id == self._id
+
+    def __hash__(self):
+        return self._id
+
+
+class Sheet():
+    def __init__(self, view):
+        self._view = view
+
+    def view(self):
+        return self._view
+
+
+_windows = []
+_active_window = None
+
+
+class Window():
+    def __init__(self, folders=()):
+        global _active_window
+        self._id = next(_ids)
+        self._folders = list(folders)
+        self._project_data = None
+        self._views = []
+        self._active_view = None
+        self._selected = []
+        # (items, on_select, kwargs) of the last quick panel shown
+        self.quick_panel = None
+        _windows.append(self)
+        _active_window = self
+
+    def id(self):
+        return self._id
+
+    def folders(self):
+        return list(self._folders)
+
+    def project_data(self):
+        return self._project_data
+
+    def set_project_data(self, data):
+        self._project_data = data
+        self._folders = [f['path'] for f in data.get('folders', [])]
+
+    def views(self):
+        return list(self._views)
+
+    def views_in_group(self, group):
+        return list(self._views) if group == 0 else []
+
+    def active_group(self):
+        return 0
+
+    def active_view(self):
+        return self._active_view
+
+    def focus_view(self, view):
+        if view in self._views:
+            self._active_view = view
+
+    def selected_sheets(self):
+        return [Sheet(view) for view in self._selected or [self._active_view]
+                if view]
+
+    def select_views(self, views):
+        self._selected = list(views)
+
+    def get_view_index(self, view):
+        if view in self._views:
+            return 0, self._views.index(view)
+        return -1, -1
+
+    def set_view_index(self, view, group, index):
+        self._views.remove(view)
+        self._views.insert(index, view)
+
+    def new_file(self):
+        view = View(self)
+        self._views.append(view)
+        self._active_view = view
+        return view
+
+    def open_file(self, fname, flags=0):
+        view = self.find_open_file(fname)
+        if view is None:
+            view = View(self, fname)
+            self._views.append(view)
+        self._active_view = view
+        return view
+
+    def find_open_file(self, fname):
+        for view in self._views:
+            if view.file_name() == fname:
+                return view
+        return None
+
+    def _close_view(self, view):
+        if view in self._views:
+            self._views.remove(view)
+            view._window = None
+        if self._active_view == view:
+            self._active_view = self._views[-1] if self._views else None
+
+    def run_command(self, cmd, args=None):
+        global _active_window
+        if cmd == 'new_window':
+            Window()
+        elif cmd == 'close_window':
+            if self in _windows:
+                _windows.remove(self)
+            if _active_window is self:
+                _active_window = _windows[-1] if _windows else None
+
+    def show_quick_panel(self, items, on_select, flags=0, selected_index=-1,
+                         on_highlight=None, placeholder=None, **kwargs):
+        self.quick_panel = (items, on_select, on_highlight)
+
+    def create_output_panel(self, name):
+        return View(None)
+
+    def set_sidebar_visible(self, visible):
+        pass
+
+    def bring_to_front(self):
+        global _active_window
+        _active_window = self
+
+
+def windows():
+    return list(_windows)
+
+
+def active_window():
+    return _active_window
+
+
+def reset_windows():
+    global _active_window
+    del _windows[:]
+    _active_window = None
@@ -0,0 +1,21 @@
+"""
+Minimal stand-in for Sublime's `sublime_plugin` module.
+"""
+
+
+class EventListener():
+    pass
+
+
+class ViewEventListener():
+    def __init__(self, view):
+        self.view = view
+
+
+class WindowCommand():
+    def __init__(self, window):
+        self.window = window
+
+
+class TextInputHandler():
+    pass
@@ -1,21 +1,452 @@
+import bisect
+import concurrent.futures
+import functools
+import hashlib
+import heapq
+import math
+import mmap
 import os
 import re
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
 import sublime
 import sublime_plugin
 
-DEBUG_ON = True
+DEBUG_ON = False
 SETTINGS_FILE = 'OpenRecent.sublime-settings'
 OS = sublime.platform()
 
 RECENT_FOLDERS = 'OpenRecent_recent_folders.json'
 FOLDERS_INFO = 'OpenRecent_folders_info.json'
 RECENT_FILES = 'OpenRecent_recent_files.json'
+HISTORY_JOURNAL = 'OpenRecent_history.journal'
+HISTORY_STATS = 'OpenRecent_history_stats.json'
+HISTORY_LOCK = 'OpenRecent_history.lock'
+# version of the compact history files, see pack_history
+COMPACT_FORMAT = 1
+
+HOME = os.path.expanduser('~')
+PATH_CACHE_SIZE = 4096
+MAX_PACKED_REGIONS = 32
+MAX_TOMBSTONES = 1000
+
+# frecency scores are relative to this time (2020-01-01) and halve every week
+FRECENCY_EPOCH = 1577836800
+FRECENCY_HALF_LIFE = 7 * 24 * 3600
+
+# used to walk JSON structure without decoding it
+JSON_TOKEN = re.compile(rb'["\[\]{}]')
+JSON_STRING = re.compile(rb'"(?:[^"\\]|\\.)*"')
+JSON_COLON = re.compile(rb'\s*:\s*')
+
+
+def frecency_score(score, when):
+    """
+    Adds a touch at time `when` to a frecency score.
+
+    Scores are log(sum(2 ** ((t - FRECENCY_EPOCH) / FRECENCY_HALF_LIFE)))
+    over the touch times t. Decaying every score to the current time would
+    subtract the same amount from all of them, so their order never changes
+    and a touch only needs to update the touched path.
+    """
+    touch = (when - FRECENCY_EPOCH) * math.log(2) / FRECENCY_HALF_LIFE
+    if score is None:
+        return touch
+    high, low = max(score, touch), min(score, touch)
+    return high + math.log1p(math.exp(low - high))
+
+
+class FrecencyRanking():
+    """
+    Paths sorted by descending frecency score, as (-score, path) keys split
+    into sorted buckets of at most 2 * LOAD keys. Updating a path is a
+    binary search over the buckets' last keys and an insert into one small
+    list, so it stays cheap however large the history gets.
+    """
+
+    LOAD = 500
+
+    def __init__(self, scores=()):
+        keys = sorted((-score, path) for path, score in scores)
+        self.buckets = [keys[i:i + self.LOAD]
+                        for i in range(0, len(keys), self.LOAD)]
+        self.maxes = [bucket[-1] for bucket in self.buckets]
+
+    def add(self, path, score):
+        key = (-score, path)
+        if not self.buckets:
+            self.buckets.append([key])
+            self.maxes.append(key)
+            return
+        index = bisect.bisect_left(self.maxes, key)
+        if index == len(self.maxes):
+            index -= 1
+            self.buckets[index].append(key)
+            self.maxes[index] = key
+        else:
+            bisect.insort(self.buckets[index], key)
+        bucket = self.buckets[index]
+        if len(bucket) > 2 * self.LOAD:
+            self.buckets.insert(index + 1, bucket[self.LOAD:])
+            del bucket[self.LOAD:]
+            self.maxes.insert(index, bucket[-1])
+
+    def remove(self, path, score):
+        key = (-score, path)
+        index = bisect.bisect_left(self.maxes, key)
+        if index == len(self.maxes):
+            return
+        bucket = self.buckets[index]
+        pos = bisect.bisect_left(bucket, key)
+        if pos == len(bucket) or bucket[pos] != key:
+            return
+        del bucket[pos]
+        if not bucket:
+            del self.buckets[index]
+            del self.maxes[index]
+        elif pos == len(bucket):
+            self.maxes[index] = bucket[-1]
+
+    def paths(self):
+        return [path for bucket in self.buckets for _, path in bucket]
+
+
+class PathTable():
+    """
+    Directory prefixes shared by many paths, each stored once, so a path
+    can be kept as its directory and its basename. The histories keep one
+    to expand their paths without storing every expanded path, and the
+    compact history files are written with one, as a list of directory ids
+    and one of basenames.
+    Any cut is lossless, so paths are cut at their last os.sep only.
+    """
+
+    def __init__(self):
+        # id -> directory with its trailing separator, for refs()
+        self.dirs = []
+        self.ids = {}
+        # directory -> (directory, expanded directory), for prefix()
+        self.prefixes = {}
+
+    def refs(self, paths):
+        """Returns [directory ids, basenames] of the paths."""
+        ids, dirs = self.ids, self.dirs
+        indexes, names = [], []
+        for path in paths:
+            cut = path.rfind(os.sep) + 1
+            directory = path[:cut]
+            index = ids.get(directory)
+            if index is None:
+                index = ids[directory] = len(dirs)
+                dirs.append(directory)
+            indexes.append(index)
+            names.append(path[cut:])
+        return [indexes, names]
+
+    def prefix(self, path):
+        """Returns the shared (directory, expanded directory) of path."""
+        directory = path[:path.rfind(os.sep) + 1]
+        prefix = self.prefixes.get(directory)
+        if prefix is None:
+            full = expand_path(directory) if directory else directory
+            prefix = self.prefixes[directory] = (directory, full)
+        return prefix
+
+    @staticmethod
+    def expand(prefix, path):
+        """Returns the expanded form of path, given its prefix."""
+        directory, full = prefix
+        if not directory:
+            return expand_path(path)
+        return full + path[len(directory):]
+
+
+class HistoryEntry():
+    __slots__ = ('prefix', 'count', 'last', 'score')
+
+    def __init__(self, prefix, score=None):
+        # (directory, expanded directory) shared through a PathTable
+        self.prefix = prefix
+        self.count = 0
+        self.last = 0
+        self.score = score
+
+
+class RecentHistory():
+    """
+    Ordered set of paths, oldest first, backed by an OrderedDict so that
+    touching, removing and trimming entries does not depend on its size.
+    Paths are stored prettified, and each entry keeps the directory of the
+    path from the history's PathTable, the number of times it was touched,
+    the last time it was, and its frecency score.
+    """
+
+    def __init__(self, paths=None):
+        self._items = OrderedDict()
+        self.table = PathTable()
+        # bumped on every change, so writers can skip unchanged histories
+        self.version = 0
+        # ('touch' | 'visit' | 'remove', path, time) changes not yet in the
+        # journal
+        self.log = []
+        # called with ('add' | 'remove', path) when the set of paths changes
+        self.on_change = None
+        # path -> time it was removed, so merges don't bring it back
+        self.removed = OrderedDict()
+        if isinstance(paths, list):
+            for path in paths:
+                if isinstance(path, str):
+                    self._items.pop(path, None)
+                    self._items[path] = HistoryEntry(
+                        self.table.prefix(path))
+        # until they are touched, rank paths by recency, below touched ones
+        count = len(self._items)
+        for index, entry in enumerate(self._items.values()):
+            entry.score = (index - count) / count
+        # built on the first call of ranked(), then kept up to date
+        self.ranking = None
+
+    def __contains__(self, path):
+        return path in self._items
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __reversed__(self):
+        return reversed(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def touch(self, path, when=None, opened=True):
+        """
+        Moves path to the most recent position, adding it if needed. Unless
+        `opened`, a path already there keeps its open count and frecency.
+        """
+        entry = self._items.get(path)
+        if entry is None:
+            entry = self._items[path] = HistoryEntry(
+                self.table.prefix(path))
+            self.removed.pop(path, None)
+            opened = True
+            if self.on_change:
+                self.on_change('add', path)
+        elif next(reversed(self._items)) != path:
+            self._items.move_to_end(path)
+        when = when or time.time()
+        entry.last = when
+        if opened:
+            if self.ranking is not None and entry.score is not None:
+                self.ranking.remove(path, entry.score)
+            entry.count += 1
+            entry.score = frecency_score(entry.score, when)
+            if self.ranking is not None:
+                self.ranking.add(path, entry.score)
+        self.version += 1
+        self.log.append(('touch' if opened else 'visit', path, when))
+
+    def remove(self, path):
+        entry = self._items.pop(path, None)
+        if entry is not None:
+            if self.ranking is not None:
+                self.ranking.remove(path, entry.score)
+            self.version += 1
+            self.log.append(('remove', path, None))
+            self._tombstone(path, time.time())
+            if self.on_change:
+                self.on_change('remove', path)
+
+    def trim(self, max_len):
+        """Drops the oldest paths above max_len and returns them."""
+        removed = []
+        while len(self._items) > max_len:
+            path, entry = self._items.popitem(last=False)
+            if self.ranking is not None:
+                self.ranking.remove(path, entry.score)
+            removed.append(path)
+        if removed:
+            self.version += 1
+            self.log.extend(('remove', path, None) for path in removed)
+            when = time.time()
+            for path in removed:
+                self._tombstone(path, when)
+            if self.on_change:
+                for path in removed:
+                    self.on_change('remove', path)
+            self._prune_table()
+        return removed
+
+    def _prune_table(self):
+        """Drops the directories of removed paths once they add up."""
+        if len(self.table.prefixes) <= 2 * len(self._items) + 64:
+            return
+        # entries are given equal prefixes one at a time, so that
+        # full() stays right on other threads meanwhile
+        table = PathTable()
+        for path, entry in self._items.items():
+            entry.prefix = table.prefix(path)
+        self.table = table
+
+    def _tombstone(self, path, when):
+        self.removed.pop(path, None)
+        self.removed[path] = when
+        while len(self.removed) > MAX_TOMBSTONES:
+            self.removed.popitem(last=False)
+
+    def load_removed(self, removed):
+        if not isinstance(removed, dict):
+            return
+        for path, when in removed.items():
+            if isinstance(when, (int, float)) and \
+                    when > self.removed.get(path, 0):
+                self._tombstone(path, when)
+
+    def merge(self, paths, stats, removed):
+        """
+        Merges in the history saved by another Sublime instance: a path is
+        kept with its latest touch, from either side, unless it was removed
+        after that. Returns whether the history changed.
+        """
+        self.load_removed(removed)
+        if not isinstance(stats, dict):
+            stats = {}
+
+        # path -> (last, position, count, score), oldest first by position
+        merged = {}
+        paths = [p for p in paths if isinstance(p, str)] \
+            if isinstance(paths, list) else []
+        for index, path in enumerate(paths):
+            try:
+                count, last, score = stats[path]
+                score = float(score)
+            except (KeyError, TypeError, ValueError):
+                count, last, score = 0, 0, None
+            merged[path] = (last, index / len(paths), count, score)
+        for index, (path, entry) in enumerate(self._items.items()):
+            other = merged.get(path)
+            if other is None or entry.last >= other[0]:
+                count = max(entry.count, other[2]) if other else entry.count
+                merged[path] = (entry.last, index / len(self._items),
+                                count, entry.score)
+            else:
+                merged[path] = other[:2] + (max(entry.count, other[2]),
+                                            other[3])
+
+        order = sorted(
+            (path for path, values in merged.items()
+             if values[0] > self.removed.get(path, -1)),
+            key=lambda path: merged[path][:2])
+        for path in order:
+            self.removed.pop(path, None)
+        if order == list(self._items) and all(
+                self._items[path].last == merged[path][0] and
+                self._items[path].count == merged[path][2]
+                for path in order):
+            return False
+
+        old = self._items
+        self._items = OrderedDict()
+        for index, path in enumerate(order):
+            last, _, count, score = merged[path]
+            entry = old.get(path) or HistoryEntry(self.table.prefix(path))
+            entry.count, entry.last = count, last
+            entry.score = (index - len(order)) / len(order) \
+                if score is None else score
+            self._items[path] = entry
+        self.ranking = None
+        self.version += 1
+        self._prune_table()
+        if self.on_change:
+            for path in old:
+                if path not in self._items:
+                    self.on_change('remove', path)
+            for path in self._items:
+                if path not in old:
+                    self.on_change('add', path)
+        return True
+
+    def drain_log(self):
+        log, self.log = self.log, []
+        return log
+
+    def full(self, path):
+        """Returns the expanded form of path."""
+        entry = self._items.get(path)
+        if entry is None:
+            return expand_path(path)
+        path_calls.stored += 1
+        return PathTable.expand(entry.prefix, path)
+
+    def last_touch(self, path):
+        entry = self._items.get(path)
+        return entry.last if entry else 0
+
+    def entries_newest_first(self):
+        """Returns (path, expanded path, last touch), newest first."""
+        items = self._items
+        expand = PathTable.expand
+        return [(path, expand(items[path].prefix, path), items[path].last)
+                for path in reversed(items)]
+
+    def newest_first(self):
+        path_calls.stored += len(self._items)
+        return list(reversed(self._items))
+
+    def ranked(self):
+        """Returns the paths by descending frecency."""
+        if self.ranking is None:
+            self.ranking = FrecencyRanking(
+                (path, entry.score) for path, entry in self._items.items())
+        path_calls.stored += len(self._items)
+        return self.ranking.paths()
+
+    def to_list(self):
+        return list(self._items)
+
+    def stats(self):
+        """Returns {path: [count, last, score]} for the touched paths."""
+        return {path: [entry.count, entry.last, entry.score]
+                for path, entry in self._items.items() if entry.count}
+
+    def load_stats(self, stats):
+        if not isinstance(stats, dict):
+            return
+        for path, values in stats.items():
+            entry = self._items.get(path)
+            try:
+                count, last, score = values
+                score = float(score)
+            except (TypeError, ValueError):
+                continue
+            if entry is not None:
+                if self.ranking is not None:
+                    self.ranking.remove(path, entry.score)
+                entry.count, entry.last, entry.score = count, last, score
+                if self.ranking is not None:
+                    self.ranking.add(path, score)
+
 
 settings = {}
 prefs_subl_history = {}
-folders_hist = []
-folders_info = {}
-files_hist = []
+folders_hist = RecentHistory()
+# folder -> working set, in order of use (see WorkingSets)
+folders_info = OrderedDict()
+files_hist = RecentHistory()
+# held while mutating or snapshotting the history
+history_lock = threading.RLock()
+# incremental updates: window id -> {'folders': [...], 'files': {file: count}}
+tracked_windows = {}
+# view id -> (window id, file)
+tracked_views = {}
 
 
 def debug(var, message=''):
@@ -26,11 +457,217 @@ def debug(var, message=''):
             print('OpenRecent Debug: %s' % message)
 
 
+class Timing():
+    __slots__ = ('calls', 'total', 'max', 'buckets', 'recent')
+
+    def __init__(self, ring_size):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        # bit length of the duration in microseconds -> calls
+        self.buckets = {}
+        self.recent = deque(maxlen=ring_size)
+
+
+class Instruments():
+    """
+    Timings and counters of the plugin's hot paths, reported by the
+    open_recent_stats command. They are only collected while the
+    `instrumentation` setting is on; otherwise a timed call costs one
+    attribute check.
+    Each timing keeps a histogram of all durations in power-of-two
+    microsecond buckets, and the last RING_SIZE durations, which give the
+    percentiles.
+    """
+    RING_SIZE = 512
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.counts = {}
+
+    def timed(self, name):
+        """Decorator timing each call of func, and the path calls it saved."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                paths_before = path_calls.total()
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start)
+                    saved = path_calls.total() - paths_before
+                    if saved:
+                        self.count('%s path calls saved' % name, saved)
+            return wrapper
+        return decorator
+
+    def record(self, name, seconds):
+        if not self.enabled:
+            return
+        bucket = int(seconds * 1e6).bit_length()
+        with self.lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                timing = self.timings[name] = Timing(self.RING_SIZE)
+            timing.calls += 1
+            timing.total += seconds
+            timing.max = max(timing.max, seconds)
+            timing.buckets[bucket] = timing.buckets.get(bucket, 0) + 1
+            timing.recent.append(seconds)
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            with self.lock:
+                self.counts[name] = self.counts.get(name, 0) + amount
+
+    @staticmethod
+    def histogram_percentile(timing, fraction):
+        """Upper bound in ms of the bucket holding the given fraction."""
+        seen = 0
+        for bucket in sorted(timing.buckets):
+            seen += timing.buckets[bucket]
+            if seen >= fraction * timing.calls:
+                return (1 << bucket) / 1000
+        return 0
+
+    def report(self):
+        lines = ['%-40s %7s %9s %9s %9s %11s' % (
+            'timing', 'calls', 'p50 ms', 'p99 ms', 'max ms', 'all p99 <')]
+        with self.lock:
+            for name in sorted(self.timings):
+                timing = self.timings[name]
+                recent = sorted(timing.recent)
+                lines.append('%-40s %7d %9.2f %9.2f %9.2f %11.2f' % (
+                    name, timing.calls, recent[len(recent) // 2] * 1000,
+                    recent[int(len(recent) * 0.99)] * 1000,
+                    timing.max * 1000,
+                    self.histogram_percentile(timing, 0.99)))
+            lines.append('')
+            for name in sorted(self.counts):
+                lines.append('%-40s %7d' % (name, self.counts[name]))
+        lines.append('')
+        lines.append('startup: %s' % history_loader.stats())
+        lines.append('session cache: %s' % session_cache.stats())
+        lines.append('folders info: %s' % working_sets.stats())
+        lines.append('prettify_path cache: %s' % (prettify_path.cache_info(),))
+        lines.append('expand_path cache: %s' % (expand_path.cache_info(),))
+        lines.append('stored path forms used: %d' % path_calls.stored)
+        if not self.enabled:
+            lines.append('')
+            lines.append('Timings are only collected while the '
+                         '"instrumentation" setting is on.')
+        return '\n'.join(lines) + '\n'
+
+
+instruments = Instruments()
+
+
+def apply_settings():
+    global DEBUG_ON
+    DEBUG_ON = bool(settings.get('debug', False))
+    instruments.enabled = bool(settings.get('instrumentation', False))
+
+
+class HistoryLoader():
+    """
+    Loads the history files on the async thread instead of in
+    plugin_loaded, or on first use by a command if that comes first.
+    Listener events arriving before then are queued, and replayed in order
+    once the history is loaded.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self.loaded = False
+        self.queue = []
+        self.started = 0
+        self.plugin_loaded_time = 0
+        self.ready_time = 0
+        self.load_time = 0
+        self.replayed = 0
+
+    def start(self):
+        self.started = time.perf_counter()
+        sublime.set_timeout_async(self.load, 0)
+
+    def load(self):
+        with self.load_lock:
+            if self.loaded:
+                return
+            start = time.perf_counter()
+            try:
+                load_history_files()
+            except Exception as Inst:
+                # one bad file must not leave the plugin waiting for it
+                print('OpenRecent Exception:', Inst)
+                reset_history()
+            self.load_time = time.perf_counter() - start
+            while True:
+                with self.lock:
+                    queued, self.queue = self.queue, []
+                    if not queued:
+                        self.loaded = True
+                        break
+                self.replayed += len(queued)
+                for call in queued:
+                    try:
+                        call()
+                    except Exception as Inst:
+                        print('OpenRecent Exception:', Inst)
+            self.ready_time = time.perf_counter() - self.started
+        debug(None, 'startup: %s' % self.stats())
+
+    def ensure_loaded(self):
+        """Loads the history right away if it is not loaded yet."""
+        if not self.loaded:
+            self.load()
+
+    def deferred(self, func):
+        """Decorator queueing calls of func until the history is loaded."""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self.loaded:
+                with self.lock:
+                    if not self.loaded:
+                        self.queue.append(lambda: func(*args, **kwargs))
+                        return
+            return func(*args, **kwargs)
+        return wrapper
+
+    def stats(self):
+        return ('plugin_loaded {:.1f} ms, history loaded in {:.1f} ms and '
+                'ready {:.1f} ms after plugin_loaded, {} queued events '
+                'replayed').format(
+            self.plugin_loaded_time * 1000, self.load_time * 1000,
+            self.ready_time * 1000, self.replayed)
+
+
+history_loader = HistoryLoader()
+
+
 def plugin_loaded():
     global settings, prefs_subl_history
+    start = time.perf_counter()
     settings = sublime.load_settings(SETTINGS_FILE)
+    apply_settings()
+    settings.add_on_change('OpenRecent', apply_settings)
     prefs_subl_history = PrefSublHist()
-    load_history_files()
+    history_loader.start()
+    session_cache.start_polling()
+    history_loader.plugin_loaded_time = time.perf_counter() - start
+
+
+def plugin_unloaded():
+    settings.clear_on_change('OpenRecent')
+    session_cache.stop_polling()
+    path_checker.shutdown()
+    history_writer.flush()
 
 
 def get_int(num, default_num):
@@ -46,24 +683,71 @@ def get_int(num, default_num):
         return default_num
 
 
+def history_path(name):
+    return os.path.join(sublime.packages_path(), 'User', name)
+
+
+@instruments.timed('load_history_files')
 def load_history_files():
     global folders_hist, folders_info, files_hist
-    recent_folders = os.path.join(
-        sublime.packages_path(), 'User', RECENT_FOLDERS)
-    recent_folders_info = os.path.join(
-        sublime.packages_path(), 'User', FOLDERS_INFO)
-    recent_files = os.path.join(
-        sublime.packages_path(), 'User', RECENT_FILES)
-
-    folders_hist = get_data(recent_folders, [])
-    files_hist = get_data(recent_files, [])
-    folders_info = get_data(recent_folders_info, {})
+    recent_folders = history_path(RECENT_FOLDERS)
+    recent_folders_info = history_path(FOLDERS_INFO)
+    recent_files = history_path(RECENT_FILES)
+
+    with history_lock:
+        folders = unpack_history(get_data(recent_folders, []))
+        files = unpack_history(get_data(recent_files, []))
+        info = unpack_folders_info(get_data(recent_folders_info, {}))
+        history_writer.unreadable = {
+            name for name, data in ((RECENT_FOLDERS, folders),
+                                    (RECENT_FILES, files),
+                                    (FOLDERS_INFO, info)) if data is None}
+        for name in history_writer.unreadable:
+            debug(name, 'Written by a later version of OpenRecent, '
+                  'so left as it is')
+        folders_hist = RecentHistory(folders)
+        files_hist = RecentHistory(files)
+        folders_info = OrderedDict(info or {})
+        stats = get_data(history_path(HISTORY_STATS), {})
+        if isinstance(stats, dict):
+            folders_hist.load_stats(stats.get('folders'))
+            files_hist.load_stats(stats.get('files'))
+            removed = stats.get('removed') or {}
+            folders_hist.load_removed(removed.get('folders'))
+            files_hist.load_removed(removed.get('files'))
+        search_index.attach('folders', folders_hist)
+        search_index.attach('files', files_hist)
+        if history_journal.replay() or history_journal.damaged:
+            history_changed()
+        working_sets.evict()
+        history_journal.reset_saved_info()
     sanitize_folders()
+    working_sets.compact()
 
 
+def reset_history():
+    """
+    Falls back to an empty history when the history files could not be
+    loaded. Those files are then left as they are instead of being saved
+    over with it.
+    """
+    global folders_hist, folders_info, files_hist
+    with history_lock:
+        folders_hist = RecentHistory()
+        files_hist = RecentHistory()
+        folders_info = OrderedDict()
+        search_index.attach('folders', folders_hist)
+        search_index.attach('files', files_hist)
+        history_journal.reset_saved_info()
+    history_writer.load_failed = True
+
+
+@instruments.timed('get_data')
 def get_data(path: str, default=[]):
     data = default
+    instruments.count('stat')
     if os.path.exists(path):
+        instruments.count('file read')
         with open(path, 'r', encoding="utf-8") as f:
             try:
                 data = sublime.decode_value(f.read())
@@ -75,6 +759,7 @@ def get_data(path: str, default=[]):
             if not data:
                 data = default
     else:
+        instruments.count('file write')
         with open(path, 'w', encoding="utf-8") as f:
             debug(path, 'creating file')
             data = default
@@ -83,43 +768,606 @@ def get_data(path: str, default=[]):
     return data
 
 
+def compact_history_files():
+    return settings.get('compact_history_files', False)
+
+
+def pack_history(paths):
+    """
+    Returns the paths in the compact format of the history files:
+        {"version": 1, "dirs": [directory, ...],
+         "paths": [[directory id, ...], [basename, ...]]}
+    """
+    table = PathTable()
+    refs = table.refs(paths)
+    return {'version': COMPACT_FORMAT, 'dirs': table.dirs, 'paths': refs}
+
+
+def compact_version(data):
+    """Returns the version of a compact history file, 0 for a plain one."""
+    if isinstance(data, dict) and 'version' in data:
+        return data['version']
+    return 0
+
+
+def compact_dirs(data):
+    dirs = data.get('dirs')
+    return dirs if isinstance(dirs, list) else []
+
+
+def unpack_paths(dirs, refs):
+    """Returns the paths of [directory ids, basenames]."""
+    try:
+        indexes, names = refs
+        return [dirs[index] + name for index, name in zip(indexes, names)]
+    except (TypeError, ValueError, IndexError) as Inst:
+        debug(Inst, 'Invalid paths in a compact history file')
+        return []
+
+
+def unpack_history(data):
+    """
+    Returns the paths of a history file, in either format, or None if it
+    was written by a later version in a format this one can't read.
+    """
+    version = compact_version(data)
+    if not version:
+        return data if isinstance(data, list) else []
+    if version != COMPACT_FORMAT:
+        return None
+    return unpack_paths(compact_dirs(data), data.get('paths'))
+
+
+def pack_folders_info(info):
+    """
+    Returns folders_info in the compact format, with the opened files as
+    the paths in pack_history, the active file as [directory id, basename]
+    and the view states as [[directory id, ...], [basename, ...],
+    [state, ...]]:
+        {"version": 1, "dirs": [directory, ...],
+         "folders": {folder: folder_info, ...}}
+    """
+    table = PathTable()
+    folders = {}
+    for folder, folder_info in info.items():
+        packed = dict(folder_info)
+        if isinstance(packed.get('opened_files'), list):
+            packed['opened_files'] = table.refs(packed['opened_files'])
+        if packed.get('active_file'):
+            indexes, names = table.refs((packed['active_file'],))
+            packed['active_file'] = indexes + names
+        if isinstance(packed.get('view_states'), dict):
+            states = packed['view_states']
+            packed['view_states'] = table.refs(states) + [
+                list(states.values())]
+        folders[folder] = packed
+    return {'version': COMPACT_FORMAT, 'dirs': table.dirs,
+            'folders': folders}
+
+
+def unpack_folders_info(data):
+    """
+    Returns the folders_info of a folders info file, in either format, or
+    None as unpack_history does.
+    """
+    if not isinstance(data, dict):
+        return {}
+    version = compact_version(data)
+    if not version:
+        return data
+    if version != COMPACT_FORMAT:
+        return None
+    dirs = compact_dirs(data)
+    folders = data.get('folders')
+    info = {}
+    for folder, packed in (folders.items()
+                           if isinstance(folders, dict) else ()):
+        if not isinstance(packed, dict):
+            continue
+        folder_info = dict(packed)
+        if 'opened_files' in packed:
+            folder_info['opened_files'] = unpack_paths(
+                dirs, packed['opened_files'])
+        if isinstance(packed.get('active_file'), list):
+            files = unpack_paths(dirs, [packed['active_file'][:1],
+                                        packed['active_file'][1:]])
+            folder_info['active_file'] = files[0] if files else ''
+        states = packed.get('view_states')
+        if isinstance(states, list):
+            files = unpack_paths(dirs, states[:2])
+            valid = len(states) == 3 and isinstance(states[2], list)
+            folder_info['view_states'] = \
+                dict(zip(files, states[2])) if valid else {}
+        info[folder] = folder_info
+    return info
+
+
+class PathChecker():
+    """
+    Checks whether paths exist on a thread pool, so that slow network mounts
+    don't block the UI or the async thread. Answers are cached for
+    `path_check_ttl` ms, for the last PATH_CACHE_SIZE paths checked;
+    `exists` returns the cached answer right away, even if stale, and
+    refreshes it in the background.
+    A check that hangs, e.g. on an unresponsive mount, holds its worker
+    until the stat returns: once all of them hang, later checks wait in the
+    queue, check_many leaves them out after its timeout and `exists` keeps
+    answering from the cache.
+    """
+
+    def __init__(self, workers=4):
+        self.workers = workers
+        self.executor = None
+        # path -> (exists, time checked), least recently checked first
+        self.cache = OrderedDict()
+        # path -> future of the check in progress
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def _submit(self, path):
+        with self.lock:
+            future = self.pending.get(path)
+            if future is None:
+                if self.executor is None:
+                    self.executor = concurrent.futures.ThreadPoolExecutor(
+                        self.workers)
+                future = self.executor.submit(self._check, path)
+                self.pending[path] = future
+            return future
+
+    def _check(self, path):
+        instruments.count('stat')
+        exists = os.path.exists(expand_path(path))
+        with self.lock:
+            self.cache.pop(path, None)
+            self.cache[path] = (exists, time.time())
+            if len(self.cache) > PATH_CACHE_SIZE:
+                self.cache.popitem(last=False)
+            self.pending.pop(path, None)
+        return exists
+
+    def fresh(self, path):
+        """Returns the cached (exists, time checked) if fresh, else None."""
+        ttl = get_int(settings.get('path_check_ttl'), 60000) / 1000
+        entry = self.cache.get(path)
+        if entry is not None and time.time() - entry[1] < ttl:
+            return entry
+        return None
+
+    def exists(self, path, default=True):
+        """
+        Returns whether path exists as last checked, or default if it never
+        was, and checks it again in the background if the answer is stale.
+        """
+        if self.fresh(path) is None:
+            self._submit(path)
+        entry = self.cache.get(path)
+        return entry[0] if entry else default
+
+    def check_many(self, paths, callback):
+        """
+        Checks paths in the background and calls callback({path: exists})
+        on the async thread. Paths not checked within `path_check_timeout`
+        ms of the call, for the whole batch, are left out of the results.
+        The checks are
+        submitted from the waiting thread too, so the caller returns at
+        once however many paths there are.
+        """
+        timeout = get_int(settings.get('path_check_timeout'), 2000) / 1000
+
+        deadline = time.time() + timeout
+
+        def wait():
+            results = {}
+            futures = []
+            for path in paths:
+                entry = self.fresh(path)
+                if entry is not None:
+                    results[path] = entry[0]
+                else:
+                    futures.append((path, self._submit(path)))
+            for path, future in futures:
+                try:
+                    results[path] = future.result(
+                        max(0, deadline - time.time()))
+                except concurrent.futures.TimeoutError:
+                    debug(path, 'Timed out checking')
+            sublime.set_timeout_async(lambda: callback(results), 0)
+
+        waiter = threading.Thread(target=wait, name='OpenRecent path check')
+        waiter.daemon = True
+        waiter.start()
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+                self.executor = None
+
+
+path_checker = PathChecker()
+
+
 def sanitize_folders():
-    if isinstance(folders_hist, list) and isinstance(folders_info, dict):
-        no_paths = [path for path in folders_hist if not os.path.exists(os.path.expanduser(path))]
-        for path in no_paths:
-            folders_hist.remove(path)
-            folders_info.pop(path, None)
+    """Removes folders that no longer exist, in the background."""
+    def remove_missing(results):
+        no_paths = [path for path, exists in results.items() if not exists]
+        if not no_paths:
+            return
+        with history_lock:
+            for path in no_paths:
+                folders_hist.remove(path)
+                folders_info.pop(path, None)
+        history_changed()
+
+    path_checker.check_many(list(folders_hist), remove_missing)
+
+
+class WorkingSets():
+    """
+    Keeps folders_info, the working set of each folder, bounded. A folder
+    keeps its last `max_folder_files` opened files, and at most
+    `max_folders_info` folders are kept: folders_info is an OrderedDict in
+    order of use, and the least recently used folders are evicted first,
+    starting with those that are not in the recent folders.
+    A compaction pass in the background, after loading and at most every
+    COMPACT_INTERVAL seconds after a save, also drops the folders that are
+    neither recent nor open, and the files that no longer exist.
+    """
+    COMPACT_INTERVAL = 3600
+
+    def __init__(self):
+        self.last_compaction = 0
+        self.evicted = 0
+        self.compacted = 0
+
+    @staticmethod
+    def touch(folder):
+        """Marks the folder as the most recently used."""
+        if folder in folders_info:
+            folders_info.move_to_end(folder)
+
+    @staticmethod
+    def trim_files(folder_info):
+        """Drops the first opened files above `max_folder_files`."""
+        limit = get_int(settings.get('max_folder_files'), 100)
+        opened_files = folder_info.get('opened_files', [])
+        excess = len(opened_files) - limit
+        if not limit or excess <= 0:
+            return
+        active_file = folder_info.get('active_file')
+        dropped = set([f for f in opened_files
+                       if f != active_file][:excess])
+        opened_files[:] = [f for f in opened_files if f not in dropped]
+        states = folder_info.get('view_states', {})
+        for file in dropped:
+            states.pop(file, None)
+
+    def evict(self):
+        """Evicts the least recently used folders above the limit."""
+        limit = get_int(settings.get('max_folders_info'), 100)
+        excess = len(folders_info) - limit
+        if not limit or excess <= 0:
+            return
+        evicted = [f for f in folders_info if f not in folders_hist][:excess]
+        if len(evicted) < excess:
+            kept = [f for f in folders_info if f in folders_hist]
+            evicted += kept[:excess - len(evicted)]
+        for folder in evicted:
+            del folders_info[folder]
+        self.evicted += len(evicted)
+
+    def maybe_compact(self):
+        if time.time() - self.last_compaction > self.COMPACT_INTERVAL:
+            self.compact()
+
+    def compact(self):
+        """
+        Drops the folders that are neither recent nor open in a window, then
+        the opened files that no longer exist, once they were checked in the
+        background.
+        """
+        self.last_compaction = time.time()
+        open_folders = {prettify_path(folder) for window in sublime.windows()
+                        for folder in window.folders()}
+        with history_lock:
+            orphans = [folder for folder in folders_info
+                       if folder not in folders_hist and
+                       folder not in open_folders]
+            for folder in orphans:
+                del folders_info[folder]
+            self.compacted += len(orphans)
+            for folder_info in folders_info.values():
+                self.trim_files(folder_info)
+            files = {file for folder_info in folders_info.values()
+                     for file in folder_info.get('opened_files', [])}
+        if orphans:
+            history_changed()
+
+        def remove_missing(results):
+            missing = {path for path, exists in results.items() if not exists}
+            if not missing:
+                return
+            with history_lock:
+                for folder_info in folders_info.values():
+                    opened_files = folder_info.get('opened_files', [])
+                    kept = [f for f in opened_files if f not in missing]
+                    if len(kept) == len(opened_files):
+                        continue
+                    self.compacted += len(opened_files) - len(kept)
+                    folder_info['opened_files'] = kept
+                    if folder_info.get('active_file') in missing:
+                        folder_info['active_file'] = ''
+                    states = folder_info.get('view_states', {})
+                    for file in missing.intersection(states):
+                        del states[file]
+            history_changed()
+
+        path_checker.check_many(list(files), remove_missing)
 
+    @staticmethod
+    def memory_size():
+        """Returns the bytes taken by folders_info, roughly."""
+        size = sys.getsizeof(folders_info)
+        for folder, folder_info in folders_info.items():
+            size += sys.getsizeof(folder) + sys.getsizeof(folder_info)
+            for key, value in folder_info.items():
+                size += sys.getsizeof(value)
+                if isinstance(value, (list, dict)):
+                    size += sum(map(sys.getsizeof, value))
+                if isinstance(value, dict):
+                    size += sum(map(sys.getsizeof, value.values()))
+        return size
+
+    def stats(self):
+        with history_lock:
+            folders = len(folders_info)
+            files = sum(len(folder_info.get('opened_files', []))
+                        for folder_info in folders_info.values())
+            memory = self.memory_size()
+        try:
+            file_size = os.path.getsize(history_path(FOLDERS_INFO))
+        except OSError:
+            file_size = 0
+        return ('{} folders, {} opened files, {:.1f} KB in memory, {:.1f} KB '
+                'on disk, {} folders evicted, {} entries compacted').format(
+            folders, files, memory / 1024, file_size / 1024, self.evicted,
+            self.compacted)
+
+
+working_sets = WorkingSets()
 
+
+@functools.lru_cache(maxsize=PATH_CACHE_SIZE)
 def prettify_path(path: str):
-    user_home = os.path.expanduser('~') + os.sep
     if path:
-        if path.startswith(os.path.expanduser('~')):
-            return os.path.join('~', path[len(user_home):])
+        if path.startswith(HOME):
+            return os.path.join('~', path[len(HOME) + 1:])
     return path
 
 
-def set_paths_list(str_list):
-    """Prettifies paths and return list in reversed order"""
-    return list(map(prettify_path, str_list[::-1]))
+@functools.lru_cache(maxsize=PATH_CACHE_SIZE)
+def expand_path(path: str):
+    # the form prettify_path returns, without expanduser's environment lookup
+    if path == '~' or path.startswith(('~/', '~' + os.sep)):
+        return HOME + path[1:]
+    return os.path.expanduser(path)
 
 
-def display_list(str_list):
-    """Displays list in one or two lines"""
-    if settings.get('display_two_lines'):
-        return [[os.path.basename(f), os.path.dirname(f)]
-                for f in str_list]
-    else:
-        return str_list
+class PathCallCounter():
+    """
+    Counts the path derivations avoided, either answered by the
+    prettify_path/expand_path caches or by the forms stored in the history.
+    Instruments.timed reports them per command.
+    """
+
+    def __init__(self):
+        self.stored = 0
+
+    def total(self):
+        return (self.stored + prettify_path.cache_info().hits +
+                expand_path.cache_info().hits)
+
+
+path_calls = PathCallCounter()
+
+
+class PanelItems():
+    """
+    Quick panel items of a RecentHistory. They are rebuilt on the async
+    thread shortly after the history changes, and again if
+    `display_two_lines` or `sort_order` changed, so the commands get them
+    ready to show. Until that rebuild, the commands get the items last
+    built, as rebuilding a large history on the UI thread stalls it.
+    The two-line item of each path is kept between rebuilds.
+    """
+
+    WARM_DELAY = 500
+
+    def __init__(self, get_history):
+        self.get_history = get_history
+        self.key = None
+        self.paths = []
+        self.items = []
+        self.two_line_items = {}
+        self.warm_pending = False
+
+    def get(self, latest=False):
+        """
+        Returns the paths and their quick panel items, newest first, or by
+        frecency if `sort_order` is "frecency". Unless `latest`, the items
+        last built are returned when only the history changed since.
+        """
+        hist = self.get_history()
+        two_lines = bool(settings.get('display_two_lines'))
+        frecency = settings.get('sort_order') == 'frecency'
+        key = (id(hist), hist.version, two_lines, frecency)
+        if key == self.key:
+            pass
+        elif (latest or self.key is None or
+                (key[0], key[2:]) != (self.key[0], self.key[2:])):
+            self._rebuild(hist, two_lines, frecency)
+        else:
+            self.schedule_warm()
+        return self.paths, self.items
+
+    def _rebuild(self, hist, two_lines, frecency):
+        with history_lock:
+            paths = hist.ranked() if frecency else hist.newest_first()
+            key = (id(hist), hist.version, two_lines, frecency)
+        if two_lines:
+            cached = self.two_line_items
+            self.two_line_items = {
+                path: cached.get(path) or
+                [os.path.basename(path), os.path.dirname(path)]
+                for path in paths}
+            items = [self.two_line_items[path] for path in paths]
+        else:
+            items = paths
+        self.paths, self.items, self.key = paths, items, key
+
+    def schedule_warm(self):
+        if self.warm_pending:
+            return
+        self.warm_pending = True
+
+        def warm():
+            self.warm_pending = False
+            self.get(latest=True)
+
+        sublime.set_timeout_async(warm, self.WARM_DELAY)
+
+
+def show_paged_panel(window, items, on_select, placeholder, **kwargs):
+    """
+    Shows a quick panel with only the first `quick_panel_page_size` items,
+    followed by an entry expanding it into all of them. Shows all the items
+    right away if the setting is 0, they fit in a page or the item to
+    select is further down.
+    """
+    page_size = get_int(settings.get('quick_panel_page_size'), 0)
+    if (not page_size or len(items) <= page_size or
+            kwargs.get('selected_index', 0) >= page_size):
+        window.show_quick_panel(
+            items, on_select, placeholder=placeholder, **kwargs)
+        return
+
+    more = 'Show all {} items'.format(len(items))
+    if isinstance(items[0], list):
+        more = [more, 'Search the whole history']
+
+    def on_page_select(index):
+        if index == page_size:
+            sublime.set_timeout(lambda: window.show_quick_panel(
+                items, on_select, placeholder=placeholder, **kwargs), 0)
+        else:
+            on_select(index)
+
+    page_kwargs = dict(kwargs)
+    on_highlight = kwargs.get('on_highlight')
+    if on_highlight:
+        page_kwargs['on_highlight'] = \
+            lambda index: on_highlight(index) if index < page_size else None
+
+    window.show_quick_panel(
+        items[:page_size] + [more], on_page_select,
+        placeholder=placeholder, **page_kwargs)
+
+
+files_panel = PanelItems(lambda: files_hist)
+folders_panel = PanelItems(lambda: folders_hist)
+
+
+def history_changed():
+    """Called after every change of the history."""
+    history_writer.mark_dirty()
+    files_panel.schedule_warm()
+    folders_panel.schedule_warm()
+
+
+def incremental_updates():
+    return settings.get('incremental_updates', True)
 
 
 class FoldersFilesListener(sublime_plugin.ViewEventListener):
+    @history_loader.deferred
+    @instruments.timed('on_load_async')
     def on_load_async(self):
-        self._append_folders()
+        with history_lock:
+            self._append_folders()
+            if incremental_updates():
+                self._track_view()
+            else:
+                self._append_file()
+        history_changed()
 
+    @history_loader.deferred
+    @instruments.timed('on_activated_async')
     def on_activated_async(self):
-        self._update_folders_info()
-        self._append_files()
+        with history_lock:
+            if incremental_updates():
+                self._track_view()
+                self._set_active_file()
+            else:
+                self._update_folders_info()
+                self._append_files(opened=False)
+        history_changed()
+
+    @history_loader.deferred
+    @instruments.timed('on_post_save_async')
+    def on_post_save_async(self):
+        if incremental_updates():
+            with history_lock:
+                self._track_view()
+            history_changed()
+
+    @history_loader.deferred
+    @instruments.timed('on_deactivated_async')
+    def on_deactivated_async(self):
+        self._save_view_state()
+
+    @history_loader.deferred
+    @instruments.timed('on_pre_close')
+    def on_pre_close(self):
+        self._save_view_state()
+
+    @history_loader.deferred
+    @instruments.timed('on_close')
+    def on_close(self):
+        if incremental_updates():
+            with history_lock:
+                self._untrack_view()
+            history_changed()
+
+    def _save_view_state(self):
+        """
+        Keeps the selections, bookmarks and viewport of the view in the
+        working set of its folders, for up to `max_view_states` files per
+        folder.
+        """
+        window = self.view.window()
+        file_name = self.view.file_name()
+        if not window or not file_name:
+            return
+        file = prettify_path(file_name)
+        limit = get_int(settings.get('max_view_states'), 50)
+        packed = None
+        changed = False
+        with history_lock:
+            for folder in map(prettify_path, window.folders()):
+                folder_info = folders_info.get(folder)
+                if not folder_info or \
+                        file not in folder_info.get('opened_files', []):
+                    continue
+                states = folder_info.setdefault('view_states', {})
+                if file not in states and len(states) >= limit:
+                    continue
+                packed = packed or ViewSettings(self.view).pack()
+                if states.get(file) != packed:
+                    states[file] = packed
+                    changed = True
+        if changed:
+            history_changed()
 
     def _update_folders_info(self):
         window = self.view.window()
@@ -140,14 +1388,22 @@ class FoldersFilesListener(sublime_plugin.ViewEventListener):
                                 opened_files_in_folder.append(file_name)
 
                     folder_info['opened_files'] = opened_files_in_folder
+                    states = folder_info.get('view_states', {})
+                    folder_info['view_states'] = {
+                        f: states[f] for f in opened_files_in_folder
+                        if f in states}
                     active_file = prettify_path(
                         window.active_view().file_name())
                     folder_info['active_file'] = active_file
                 else:
                     folder_info['opened_files'] = []
                     folder_info['active_file'] = ''
+                    folder_info.pop('view_states', None)
 
                 folders_info[folder] = folder_info
+                working_sets.trim_files(folder_info)
+                working_sets.touch(folder)
+            working_sets.evict()
 
     def _append_folders(self):
         window = self.view.window()
@@ -158,17 +1414,16 @@ class FoldersFilesListener(sublime_plugin.ViewEventListener):
 
         if win_folders:
             for folder in win_folders:
-                folder = prettify_path(folder)
-                if folder in folders_hist:
-                    folders_hist.remove(folder)
-
-                folders_hist.append(folder)
+                folders_hist.touch(prettify_path(folder))
 
-            while len(folders_hist) > max_folders:
-                removed_folder = folders_hist.pop(0)
+            for removed_folder in folders_hist.trim(max_folders):
                 folders_info.pop(removed_folder, None)
 
-    def _append_files(self):
+    def _append_files(self, opened=True):
+        """
+        Touches the files of every view in the window, counting them as
+        opened, for frecency, only if `opened`.
+        """
         window = self.view.window()
         if not window:
             return
@@ -178,43 +1433,593 @@ class FoldersFilesListener(sublime_plugin.ViewEventListener):
         if win_views:
             for view in win_views:
                 file_name = view.file_name()
-                if file_name and os.path.exists(file_name):
-                    file = prettify_path(file_name)
-                    if file in files_hist:
-                        files_hist.remove(file)
+                if file_name and path_checker.exists(file_name):
+                    files_hist.touch(prettify_path(file_name), opened=opened)
 
-                    files_hist.append(file)
+            files_hist.trim(max_files)
 
-            while len(files_hist) > max_files:
-                files_hist.pop(0)
+    def _append_file(self):
+        file_name = self.view.file_name()
+        if file_name and path_checker.exists(file_name):
+            files_hist.touch(prettify_path(file_name))
+            files_hist.trim(get_int(settings.get('max_files'), 100))
 
+    def _track_window(self, window):
+        """
+        Scans the whole window once and starts tracking its files, so later
+        events only need to look at the view that changed.
+        """
+        self._update_folders_info()
+        self._append_files()
+        state = {
+            'folders': [prettify_path(f) for f in window.folders()],
+            'files': {}
+        }
+        for view in window.views():
+            file_name = view.file_name()
+            if file_name:
+                file = prettify_path(file_name)
+                state['files'][file] = state['files'].get(file, 0) + 1
+                tracked_views[view.id()] = (window.id(), file)
+        tracked_windows[window.id()] = state
+
+    def _track_view(self):
+        window = self.view.window()
+        if not window:
+            return
+        old = tracked_views.get(self.view.id())
+        if old and old[0] != window.id():
+            # dragged to another window, which keeps the same view
+            self._untrack_view()
+        state = tracked_windows.get(window.id())
+        if state is None or state['folders'] != list(
+                map(prettify_path, window.folders())):
+            self._track_window(window)
+            return
 
-class PreCloseWinListener(sublime_plugin.EventListener):
-    def on_pre_close_window(self, window):
+        file_name = self.view.file_name()
+        if not file_name:
+            return
+        file = prettify_path(file_name)
+        old = tracked_views.get(self.view.id())
+        if old and old[1] != file:
+            # saved under a different name
+            self._untrack_view()
+        # only the first track of a view counts as opening its file
+        opened = not old or old[1] != file
+        if opened:
+            if not path_checker.exists(file_name):
+                return
+            tracked_views[self.view.id()] = (window.id(), file)
+            state['files'][file] = state['files'].get(file, 0) + 1
+            for folder in state['folders']:
+                if file.startswith(folder):
+                    folder_info = folders_info.setdefault(
+                        folder, {'opened_files': [], 'active_file': ''})
+                    opened_files = folder_info.setdefault('opened_files', [])
+                    if file not in opened_files:
+                        opened_files.append(file)
+                        working_sets.trim_files(folder_info)
+                    working_sets.touch(folder)
+            working_sets.evict()
+
+        files_hist.touch(file, opened=opened)
+        files_hist.trim(get_int(settings.get('max_files'), 100))
+
+    def _untrack_view(self):
+        window_id, file = tracked_views.pop(self.view.id(), (None, None))
+        state = tracked_windows.get(window_id)
+        # the window is being closed: keep its working set as it is
+        if state is None or file not in state['files']:
+            return
+        state['files'][file] -= 1
+        if state['files'][file] > 0:
+            return
+        del state['files'][file]
+        for folder in state['folders']:
+            folder_info = folders_info.get(folder)
+            if folder_info and file in folder_info.get('opened_files', []):
+                folder_info['opened_files'].remove(file)
+                folder_info.get('view_states', {}).pop(file, None)
+
+    def _set_active_file(self):
+        window = self.view.window()
+        state = window and tracked_windows.get(window.id())
+        if not state or self.view != window.active_view():
+            return
+        active_file = prettify_path(self.view.file_name())
+        for folder in state['folders']:
+            folder_info = folders_info.get(folder)
+            if folder_info is not None:
+                folder_info['active_file'] = active_file
+                working_sets.touch(folder)
+
+
+class HistoryWriter():
+    """
+    Persists the history files. Changes only mark the history as dirty, and
+    the files are written on the async thread once there were no changes for
+    `save_delay` ms. Each file is replaced atomically, and files whose
+    content did not change since the last write are skipped.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.dirty = False
+        self.pending = False
+        self.last_change = 0
+        self.saved_versions = {}
+        self.saved_hashes = {}
+        # history files in a format of a later version, never overwritten
+        self.unreadable = set()
+        # whether loading failed, so that nothing is written this session
+        self.load_failed = False
+
+    @staticmethod
+    def save_delay():
+        return get_int(settings.get('save_delay'), 2000)
+
+    def mark_dirty(self):
+        with self.lock:
+            self.dirty = True
+            self.last_change = time.time()
+            if self.pending:
+                return
+            self.pending = True
+        sublime.set_timeout_async(self._debounced_flush, self.save_delay())
+
+    def _debounced_flush(self):
+        with self.lock:
+            wait = self.last_change + self.save_delay() / 1000 - time.time()
+            if wait <= 0:
+                self.pending = False
+        if wait > 0:
+            sublime.set_timeout_async(self._debounced_flush, int(wait * 1000) + 1)
+        else:
+            self.flush()
+            working_sets.maybe_compact()
+
+    @instruments.timed('flush')
+    def flush(self):
+        """Writes the dirty history files right away."""
+        with self.flush_lock:
+            with self.lock:
+                if not self.dirty:
+                    return
+                self.dirty = False
+            if self.load_failed:
+                with history_lock:
+                    folders_hist.drain_log()
+                    files_hist.drain_log()
+                return
+            if history_journal.enabled():
+                self._save_journal()
+                if not history_journal.needs_compaction():
+                    return
+            else:
+                with history_lock:
+                    folders_hist.drain_log()
+                    files_hist.drain_log()
+            # full snapshot, which makes any journal redundant
+            try:
+                if settings.get('merge_on_save'):
+                    with history_file_lock:
+                        self._merge_saved()
+                        self._save_snapshot()
+                else:
+                    self._save_snapshot()
+            except OSError as Inst:
+                debug(Inst, 'Could not save the history files')
+                # try again after the next save delay
+                self.mark_dirty()
+
+    def _save_snapshot(self):
         self._save_folders()
         self._save_folders_info()
         self._save_files()
+        self._save_stats()
+        history_journal.clear()
 
+    @staticmethod
+    def _read(name, default, unpack=None):
+        instruments.count('file read')
+        try:
+            with open(history_path(name), 'r', encoding="utf-8") as f:
+                data = sublime.decode_value(f.read())
+        except (OSError, ValueError):
+            return default
+        if unpack:
+            data = unpack(data)
+        return data if isinstance(data, type(default)) else default
+
+    def _merge_saved(self):
+        """
+        Merges in the history files as they are on disk, which another
+        Sublime instance sharing this Packages/User folder may have saved.
+        """
+        folders = self._read(RECENT_FOLDERS, [], unpack_history)
+        files = self._read(RECENT_FILES, [], unpack_history)
+        info = self._read(FOLDERS_INFO, {}, unpack_folders_info)
+        stats = self._read(HISTORY_STATS, {})
+        removed = stats.get('removed') or {}
+        with history_lock:
+            folders_hist.merge(folders, stats.get('folders'),
+                               removed.get('folders'))
+            files_hist.merge(files, stats.get('files'), removed.get('files'))
+            max_folders = get_int(settings.get('max_folders'), 30)
+            for removed_folder in folders_hist.trim(max_folders):
+                folders_info.pop(removed_folder, None)
+            files_hist.trim(get_int(settings.get('max_files'), 100))
+            for folder, folder_info in info.items():
+                if folder in folders_hist and folder not in folders_info:
+                    folders_info[folder] = folder_info
+                    # others' folders are older than those used here
+                    folders_info.move_to_end(folder, last=False)
+            working_sets.evict()
+        # the files on disk may differ from what this instance last wrote
+        self.saved_hashes.clear()
+
+    @instruments.timed('_save_journal')
+    def _save_journal(self):
+        with history_lock:
+            lines = history_journal.collect()
+        try:
+            history_journal.append(lines)
+        except OSError as Inst:
+            debug(Inst, 'Could not write %s' % history_journal.path())
+            self.mark_dirty()
+
+    def _save_history(self, name, hist):
+        if name in self.unreadable:
+            return False
+        compact = compact_history_files()
+        if self.saved_versions.get(name) == (id(hist), hist.version, compact):
+            return False
+        with history_lock:
+            version = (id(hist), hist.version, compact)
+            if compact:
+                data = sublime.encode_value(pack_history(hist))
+            else:
+                data = sublime.encode_value(hist.to_list(), True)
+        written = self._write(name, data)
+        self.saved_versions[name] = version
+        return written
+
+    @instruments.timed('_save_folders')
     def _save_folders(self):
-        folders_data = sublime.encode_value(folders_hist, True)
-        recent_folders = os.path.join(
-            sublime.packages_path(), 'User', RECENT_FOLDERS)
-        with open(recent_folders, 'w', encoding="utf-8") as f:
-            f.write(folders_data)
+        return self._save_history(RECENT_FOLDERS, folders_hist)
 
+    @instruments.timed('_save_folders_info')
     def _save_folders_info(self):
-        folders_info_data = sublime.encode_value(folders_info, True)
-        recent_folders_info = os.path.join(
-            sublime.packages_path(), 'User', FOLDERS_INFO)
-        with open(recent_folders_info, 'w', encoding="utf-8") as f:
-            f.write(folders_info_data)
+        if FOLDERS_INFO in self.unreadable:
+            return False
+        with history_lock:
+            if compact_history_files():
+                data = sublime.encode_value(pack_folders_info(folders_info))
+            else:
+                data = sublime.encode_value(folders_info, True)
+        return self._write(FOLDERS_INFO, data)
 
+    @instruments.timed('_save_files')
     def _save_files(self):
-        files_data = sublime.encode_value(files_hist, True)
-        recent_files = os.path.join(
-            sublime.packages_path(), 'User', RECENT_FILES)
-        with open(recent_files, 'w', encoding="utf-8") as f:
-            f.write(files_data)
+        return self._save_history(RECENT_FILES, files_hist)
+
+    @instruments.timed('_save_stats')
+    def _save_stats(self):
+        version = (id(folders_hist), folders_hist.version,
+                   id(files_hist), files_hist.version)
+        if self.saved_versions.get(HISTORY_STATS) == version:
+            return False
+        with history_lock:
+            data = sublime.encode_value({
+                'folders': folders_hist.stats(),
+                'files': files_hist.stats(),
+                'removed': {'folders': folders_hist.removed,
+                            'files': files_hist.removed}
+            })
+        written = self._write(HISTORY_STATS, data)
+        self.saved_versions[HISTORY_STATS] = version
+        return written
+
+    def _write(self, name, data):
+        """Atomically writes data to the history file, unless unchanged."""
+        digest = hashlib.sha1(data.encode('utf-8')).hexdigest()
+        if self.saved_hashes.get(name) == digest:
+            return False
+        path = history_path(name)
+        tmp_path = '%s.%s.tmp' % (path, os.getpid())
+        instruments.count('file write')
+        try:
+            with open(tmp_path, 'w', encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.saved_hashes[name] = digest
+        return True
+
+
+history_writer = HistoryWriter()
+
+
+class HistoryFileLock():
+    """
+    Advisory lock on OpenRecent_history.lock, held while merging and saving
+    the history files when `merge_on_save` is set, so that the Sublime
+    instances sharing a Packages/User folder save one at a time. `held` is
+    how long the last lock was held, in seconds.
+    """
+
+    def __init__(self):
+        self.file = None
+        self.acquired = 0
+        self.held = 0
+
+    def __enter__(self):
+        self.file = open(history_path(HISTORY_LOCK), 'a+')
+        try:
+            if fcntl:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+            else:
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+        except OSError:
+            self.file.close()
+            raise
+        self.acquired = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.held = time.perf_counter() - self.acquired
+        try:
+            if fcntl:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            else:
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self.file.close()
+
+
+history_file_lock = HistoryFileLock()
+
+
+class HistoryJournal():
+    """
+    Append-only log of history changes, used when `history_storage` is
+    "journal". The JSON history files are its snapshot: loading replays the
+    journal on top of them, and compacting rewrites them and empties the
+    journal. Existing JSON files therefore need no conversion, and a
+    leftover journal is folded back into them when switching back to "json".
+
+    Each line is a JSON array:
+        ["touch", "files" | "folders", path, time]
+        ["visit", "files" | "folders", path, time]
+        ["remove", "files" | "folders", path]
+        ["info", folder, folder_info | null]
+    """
+
+    def __init__(self):
+        self.records = 0
+        # folder -> encoded folder_info as last written to the journal
+        self.saved_info = {}
+        # lines collected but not written, as their append failed
+        self.unwritten = []
+        # whether replay skipped bad records, left until the next snapshot
+        self.damaged = False
+
+    @staticmethod
+    def enabled():
+        # instances sharing the history files must each merge a full
+        # snapshot under history_file_lock, which the journal would skip
+        return settings.get('history_storage') == 'journal' and \
+            not settings.get('merge_on_save')
+
+    @staticmethod
+    def path():
+        return history_path(HISTORY_JOURNAL)
+
+    def replay(self):
+        """
+        Applies the journal to the loaded history, returns the records.
+        Bad records are skipped and set `damaged`, so that the next flush
+        writes a full snapshot and starts the journal over.
+        """
+        self.records = 0
+        self.damaged = False
+        if not os.path.exists(self.path()):
+            return 0
+        instruments.count('file read')
+        hists = {'files': files_hist, 'folders': folders_hist}
+        # read as bytes, as a cut line may end inside a character
+        with open(self.path(), 'rb') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = sublime.decode_value(line.decode('utf-8'))
+                    op, key, value = record[:3]
+                    if op in ('touch', 'visit'):
+                        hists[key].touch(value,
+                                         record[3] if record[3:] else None,
+                                         op == 'touch')
+                    elif op == 'remove':
+                        hists[key].remove(value)
+                    elif op == 'info' and value is None:
+                        folders_info.pop(key, None)
+                    elif op == 'info':
+                        folders_info[key] = value
+                        folders_info.move_to_end(key)
+                except Exception as Inst:
+                    # most likely a write cut short by a crash
+                    debug(Inst, 'Skipped a bad record in %s' % self.path())
+                    self.damaged = True
+                    continue
+                self.records += 1
+        files_hist.drain_log()
+        folders_hist.drain_log()
+        return self.records
+
+    def reset_saved_info(self):
+        self.saved_info = {folder: sublime.encode_value(info)
+                           for folder, info in folders_info.items()}
+
+    def collect(self):
+        """
+        Returns the journal lines for the changes since the last call,
+        after those a failed append left unwritten.
+        """
+        records = []
+        for key, hist in (('folders', folders_hist), ('files', files_hist)):
+            records.extend([op, key, path, when] if when else [op, key, path]
+                           for op, path, when in hist.drain_log())
+        encoded = {folder: sublime.encode_value(info)
+                   for folder, info in folders_info.items()}
+        for folder, data in encoded.items():
+            if self.saved_info.get(folder) != data:
+                records.append(['info', folder, folders_info[folder]])
+        for folder in self.saved_info:
+            if folder not in encoded:
+                records.append(['info', folder, None])
+        self.saved_info = encoded
+        lines = self.unwritten + [sublime.encode_value(record)
+                                  for record in records]
+        self.unwritten = []
+        return lines
+
+    def append(self, lines):
+        if not lines:
+            return
+        instruments.count('file write')
+        data = ''.join(line + '\n' for line in lines).encode('utf-8')
+        try:
+            with open(self.path(), 'a+b') as f:
+                # don't write onto the end of a line cut short
+                if f.seek(0, os.SEEK_END):
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        data = b'\n' + data
+                f.write(data)
+        except OSError:
+            # the changes are drained already: keep them for the next call
+            self.unwritten = lines
+            raise
+        self.records += len(lines)
+
+    def needs_compaction(self):
+        if self.damaged:
+            return True
+        limit = get_int(settings.get('journal_compact_threshold'), 1000)
+        return self.records > limit
+
+    def clear(self):
+        self.records = 0
+        self.unwritten = []
+        self.damaged = False
+        if os.path.exists(self.path()):
+            os.remove(self.path())
+
+
+history_journal = HistoryJournal()
+
+
+class PreCloseWinListener(sublime_plugin.EventListener):
+    @history_loader.deferred
+    def on_pre_close_window(self, window):
+        tracked_windows.pop(window.id(), None)
+        window_index.window_closed(window)
+        # usually a no-op, as the debounced writes already saved everything;
+        # off the UI thread, as it may encode the history or wait for
+        # another instance holding history_file_lock
+        sublime.set_timeout_async(history_writer.flush, 0)
+
+
+class FolderRestore():
+    """
+    Reopens the files of a recent folder: the active file first, then the
+    rest in batches of `restore_batch_size` on the async thread, so the
+    window is usable while the other tabs load, each with its saved
+    selections and viewport. Files not opened in the last
+    `restore_defer_days` days are left for the end. Once all are open, the
+    tabs are put back in their saved order, after the tabs the window
+    already had.
+    """
+
+    def __init__(self, window, opened_files, active_file, view_states):
+        self.window = window
+        self.opened_files = opened_files
+        self.active_file = active_file
+        self.view_states = view_states
+        self.start_time = time.perf_counter()
+
+    def start(self, results):
+        files = [f for f in self.opened_files if results.get(f)]
+        if not files:
+            return
+        # e.g. when added to the project of a window with open tabs
+        full_paths = set(map(expand_path, files))
+        self.offset = len([view for view in self.window.views_in_group(0)
+                           if view.file_name() not in full_paths])
+        if self.active_file in files:
+            view = self.open(self.active_file)
+            self.window.focus_view(view)
+            instruments.record('restore: active file shown', self.elapsed())
+            debug(None, 'active file shown after %.0f ms' % (
+                self.elapsed() * 1000))
+        self.files = files
+        self.pending = self.order(
+            [f for f in files if f != self.active_file])
+        self.batch_size = get_int(settings.get('restore_batch_size'), 8)
+        if self.batch_size <= 0:
+            self.batch_size = len(self.pending) or 1
+        self.open_batch()
+
+    def order(self, files):
+        days = get_int(settings.get('restore_defer_days'), 0)
+        if days <= 0:
+            return files
+        since = time.time() - days * 86400
+        with history_lock:
+            recent = {f for f in files if files_hist.last_touch(f) >= since}
+        return ([f for f in files if f in recent] +
+                [f for f in files if f not in recent])
+
+    def open_batch(self):
+        batch = self.pending[:self.batch_size]
+        self.pending = self.pending[self.batch_size:]
+        active_view = self.window.active_view()
+        for file in batch:
+            self.open(file)
+        if active_view:
+            self.window.focus_view(active_view)
+        if self.pending:
+            sublime.set_timeout_async(self.open_batch, 10)
+        else:
+            self.restore_order()
+            instruments.record('restore: all tabs open', self.elapsed())
+            debug(None, 'all %d tabs open after %.0f ms' % (
+                len(self.files), self.elapsed() * 1000))
+
+    def open(self, file):
+        view = self.window.open_file(expand_path(file))
+        state = ViewSettings.unpack(self.view_states.get(file))
+        if state:
+            state.copyTo(view)
+        return view
+
+    def restore_order(self):
+        for index, file in enumerate(self.files, self.offset):
+            view = self.window.find_open_file(expand_path(file))
+            if view:
+                group, current = self.window.get_view_index(view)
+                if group == 0 and current != index:
+                    self.window.set_view_index(view, 0, index)
+
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
 
 
 class OpenRecentFolderCommand(sublime_plugin.WindowCommand):
@@ -225,7 +2030,7 @@ class OpenRecentFolderCommand(sublime_plugin.WindowCommand):
     def get_window(self, folder, add_to: bool):
         curwin = sublime.active_window()
         for window in sublime.windows():
-            if os.path.expanduser(folder) in window.folders() and not add_to:
+            if folders_hist.full(folder) in window.folders() and not add_to:
                 return window, True
         if (not curwin.folders() and not curwin.views()) or add_to:
             return curwin, False
@@ -236,7 +2041,8 @@ class OpenRecentFolderCommand(sublime_plugin.WindowCommand):
     def on_selected(self, index, add_to: bool):
         if index >= 0:
             folder = self.folders[index]
-            if os.path.isdir(os.path.expanduser(folder)):
+            instruments.count('ui thread stat')
+            if os.path.isdir(folders_hist.full(folder)):
                 new_win, other_win_exists = self.get_window(folder, add_to)
                 if other_win_exists:
                     new_win.bring_to_front()
@@ -257,20 +2063,21 @@ class OpenRecentFolderCommand(sublime_plugin.WindowCommand):
         opened_files = folder_info.get('opened_files', [])
         active_file = folder_info.get('active_file', '')
         if opened_files:
-            for file in folder_info['opened_files']:
-                file = os.path.expanduser(file)
-                if os.path.exists(file):
-                    window.open_file(file)
-
-        if active_file:
-            window.focus_view(window.find_open_file(active_file))
-
+            restore = FolderRestore(window, opened_files, active_file,
+                                    folder_info.get('view_states', {}))
+            path_checker.check_many(
+                opened_files,
+                lambda results: sublime.set_timeout(
+                    lambda: restore.start(results), 0))
+
+    @instruments.timed('open_recent_folder')
     def run(self, add_to_project=False):
-        self.folders = set_paths_list(folders_hist)
+        history_loader.ensure_loaded()
+        self.folders, items = folders_panel.get()
         placeholder = "Open Recent Folder (out of %s)" % len(self.folders)
         if len(self.folders) > 0:
             self.window.show_quick_panel(
-                display_list(self.folders),
+                items,
                 on_select=lambda idx: self.on_selected(idx, add_to_project),
                 placeholder=placeholder)
         else:
@@ -282,7 +2089,7 @@ class RemoveRecentFolderCommand(sublime_plugin.WindowCommand):
         if index >= 0:
             folder = self.folders[index]
             for window in sublime.windows():
-                if os.path.expanduser(folder) in window.folders():
+                if folders_hist.full(folder) in window.folders():
                     msg = """First close the window with the folder
                     you want to remove."""
                     sublime.message_dialog(msg)
@@ -290,18 +2097,19 @@ class RemoveRecentFolderCommand(sublime_plugin.WindowCommand):
             validator = sublime.ok_cancel_dialog(
                 'Remove "%s" from history?' % folder)
             if validator:
-                msg = """The folder will be completely removed after closing
-                a window or Sublime Text"""
-                sublime.message_dialog(msg)
-                folders_hist.remove(folder)
-                folders_info.pop(folder, None)
+                with history_lock:
+                    folders_hist.remove(folder)
+                    folders_info.pop(folder, None)
+                history_changed()
 
+    @instruments.timed('remove_recent_folder')
     def run(self):
-        self.folders = set_paths_list(folders_hist)
+        history_loader.ensure_loaded()
+        self.folders, items = folders_panel.get()
         placeholder = "Delete folder out of recent history"
         if len(self.folders) > 0:
             self.window.show_quick_panel(
-                display_list(self.folders),
+                items,
                 on_select=lambda idx: self.on_selected(idx),
                 placeholder=placeholder)
         else:
@@ -334,8 +2142,9 @@ class OpenRecentFilesCommand(sublime_plugin.WindowCommand):
 
     def show_preview(self, index):
         if index >= 0 and settings.get('show_file_preview'):
-            file = self.files[index]
-            if os.path.isfile(os.path.expanduser(file)):
+            file = files_hist.full(self.files[index])
+            instruments.count('ui thread stat')
+            if os.path.isfile(file):
                 self.window.open_file(file, sublime.TRANSIENT)
 
     def on_selected(self, index):
@@ -343,8 +2152,9 @@ class OpenRecentFilesCommand(sublime_plugin.WindowCommand):
         if index >= 0:
             if self.is_transient(active_view):
                 active_view.close()
-            file = self.files[index]
-            if os.path.isfile(os.path.expanduser(file)):
+            file = files_hist.full(self.files[index])
+            instruments.count('ui thread stat')
+            if os.path.isfile(file):
                 new_win = self.get_window()
                 new_win.open_file(file)
 
@@ -352,12 +2162,17 @@ class OpenRecentFilesCommand(sublime_plugin.WindowCommand):
             if self.is_transient(active_view):
                 active_view.close()
 
+    @instruments.timed('open_recent_files')
     def run(self):
-        self.files = set_paths_list(files_hist)
+        history_loader.ensure_loaded()
+        if settings.get('merge_session_history'):
+            self.files, items = merged_files.get()
+        else:
+            self.files, items = files_panel.get()
         placeholder = "Open Recent File (out of %s)" % len(self.files)
         if len(self.files) > 0:
-            self.window.show_quick_panel(
-                display_list(self.files),
+            show_paged_panel(
+                self.window, items,
                 on_select=lambda idx: self.on_selected(idx),
                 placeholder=placeholder,
                 on_highlight=self.show_preview)
@@ -391,6 +2206,200 @@ class PrefSublHist():
         return ses_path
 
 
+def find_json_member(buf, key: bytes, pos):
+    """
+    Returns the offset of the value of `key` among the direct members of the
+    JSON object starting at pos, or -1. Nested values are skipped without
+    being decoded.
+    """
+    depth = 0
+    while True:
+        token = JSON_TOKEN.search(buf, pos)
+        if not token:
+            return -1
+        if token.group() == b'"':
+            string = JSON_STRING.match(buf, token.start())
+            if not string:
+                return -1
+            if depth == 1 and string.group() == key:
+                colon = JSON_COLON.match(buf, string.end())
+                if colon:
+                    return colon.end()
+            pos = string.end()
+            continue
+        depth += 1 if token.group() in b'[{' else -1
+        if depth <= 0:
+            return -1
+        pos = token.end()
+
+
+def skip_json_value(buf, pos):
+    """Returns the end offset of the JSON array or object starting at pos."""
+    depth = 0
+    while True:
+        token = JSON_TOKEN.search(buf, pos)
+        if not token:
+            return -1
+        if token.group() == b'"':
+            string = JSON_STRING.match(buf, token.start())
+            if not string:
+                return -1
+            pos = string.end()
+            continue
+        depth += 1 if token.group() in b'[{' else -1
+        pos = token.end()
+        if depth == 0:
+            return pos
+
+
+def extract_json_path(buf, keys):
+    """Decodes only the value found following keys from the root object."""
+    pos = 0
+    for key in keys:
+        if pos and buf[pos:pos + 1] != b'{':
+            return None
+        pos = find_json_member(buf, b'"' + key + b'"', pos)
+        if pos < 0:
+            return None
+    end = skip_json_value(buf, pos)
+    if end < 0:
+        return None
+    return sublime.decode_value(buf[pos:end].decode('utf-8'))
+
+
+def extract_session_histories(path):
+    """
+    Reads folder_history and settings.new_window_settings.file_history from
+    the session file at path without decoding the rest of it, which mostly
+    holds the windows' buffers. Returns None if either can't be found.
+    """
+    instruments.count('file read')
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            folders = extract_json_path(buf, [b'folder_history'])
+            files = extract_json_path(
+                buf, [b'settings', b'new_window_settings', b'file_history'])
+    if not isinstance(folders, list) or not isinstance(files, list):
+        return None
+    return {'folders': folders, 'files': files}
+
+
+class SessionCache():
+    """
+    Histories read from Sublime's session file, shared by the session
+    history commands and only parsed again when the file's mtime or size
+    change.
+
+    The session is read on the async thread, when the plugin loads and
+    whenever a periodic stat shows it changed, so the commands can show
+    the prefetched histories without touching the disk.
+    """
+
+    def __init__(self):
+        self.key = None
+        self.data = None
+        self.error = None
+        self.polling = False
+        self.callbacks = []
+        self.hits = 0
+        self.misses = 0
+        self.parse_time = 0.0
+
+    def start_polling(self):
+        self.polling = True
+        sublime.set_timeout_async(self._poll, 0)
+
+    def stop_polling(self):
+        self.polling = False
+
+    def _poll(self):
+        if not self.polling:
+            return
+        self.refresh()
+        interval = get_int(settings.get('session_poll_interval'), 5000)
+        if interval:
+            sublime.set_timeout_async(self._poll, interval)
+
+    @instruments.timed('session refresh')
+    def refresh(self):
+        """Re-reads the session if it changed. Runs on the async thread."""
+        fpath = prefs_subl_history.get_session_path()
+        if not os.path.exists(fpath):
+            self.error = "Path '{}' does not exist".format(fpath)
+        else:
+            try:
+                self.get(fpath)
+                self.error = None
+            except Exception as Inst:
+                print('OpenRecent Exception:', Inst)
+                self.error = 'Could not load JSON data from {}'.format(fpath)
+
+        error = self.error if self.data is None else None
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            sublime.set_timeout(
+                lambda callback=callback: callback(self.data, error), 0)
+
+    def when_ready(self, callback):
+        """
+        Calls callback(data, error) on the UI thread with the histories,
+        right away if they were prefetched, or once they are loaded.
+        """
+        if self.data is not None:
+            callback(self.data, None)
+        else:
+            self.callbacks.append(callback)
+        # picks up changes the poll has not seen yet, for the next time
+        sublime.set_timeout_async(self.refresh, 0)
+
+    @instruments.timed('session get')
+    def get(self, path):
+        """
+        Returns {'folders': [...], 'files': [...]} from the session at path.
+        """
+        instruments.count('stat')
+        stat = os.stat(path)
+        key = (path, stat.st_mtime, stat.st_size)
+        if key == self.key:
+            self.hits += 1
+            return self.data
+
+        start = time.perf_counter()
+        data = None
+        try:
+            data = extract_session_histories(path)
+        except Exception as Inst:
+            debug(Inst, 'Partial session parse failed')
+        if data is None:
+            data = self.decode(path)
+        self.parse_time += time.perf_counter() - start
+        self.misses += 1
+        self.key, self.data = key, data
+        search_index.sync_session(data)
+        debug(self.stats(), 'Session cache')
+        return data
+
+    @staticmethod
+    def decode(path):
+        """Full decode of the session file, slower but always works."""
+        instruments.count('file read')
+        with open(path, encoding="utf-8") as f:
+            session_json = sublime.decode_value(f.read())
+        return {
+            'folders': session_json.get('folder_history', []),
+            'files': session_json.get('settings', {}).get(
+                'new_window_settings', {}).get('file_history', [])
+        }
+
+    def stats(self):
+        return '{} hits, {} misses, {:.1f} ms per parse'.format(
+            self.hits, self.misses,
+            self.parse_time * 1000 / self.misses if self.misses else 0)
+
+
+session_cache = SessionCache()
+
+
 class ConfSublHist():
     """Set configuration for using Sublime history files"""
 
@@ -401,34 +2410,24 @@ class ConfSublHist():
         self.display_list = []
         self.cache = {'last_selection': '', 'last_index': 0}
 
-    def load_items_data(self):
+    def load_items_data(self, on_loaded):
         """
-        Loads the list of folders to be shown in the quick panel
+        Loads the list of folders to be shown in the quick panel from the
+        prefetched session histories, then calls on_loaded
         """
 
-        fpath = prefs_subl_history.get_session_path()
+        def loaded(session_data, error):
+            if error:
+                sublime.message_dialog(error)
+                return
+            self.items = self.get_session_data(session_data)
+            self.items_count = len(self.items)
+            on_loaded()
 
-        if os.path.exists(fpath):
-            with open(fpath, encoding="utf-8") as f:
-                try:
-                    session_json = sublime.decode_value(f.read())
-                    # self.items = session_json['folder_history']
-                    self.items = self.get_session_data(session_json)
-                    self.items_count = len(self.items)
-                except Exception as Inst:
-                    print('OpenRecent Exception:', Inst)
-                    sublime.message_dialog(
-                        'Could not load JSON data from {}'.format(fpath))
-        else:
-            sublime.message_dialog(
-                "Path '{}' does not exist".format(fpath))
+        session_cache.when_ready(loaded)
 
-    def get_session_data(self, object):
-        data = []
-        if self.type == 'folders':
-            data = object['folder_history']
-        if self.type == 'files':
-            data = object['settings']['new_window_settings']['file_history']
+    def get_session_data(self, session_data):
+        data = session_data.get(self.type, [])
 
         if OS == 'windows':
             data = list(map(self.windofy_path, data))
@@ -498,7 +2497,8 @@ class OpenFolderHistoryCommand(sublime_plugin.WindowCommand):
         if index >= 0:
             folder = self.conf.items[index]
             self.conf.update_cache(last_selection=folder)
-            if os.path.isdir(os.path.expanduser(folder)):
+            instruments.count('ui thread stat')
+            if os.path.isdir(expand_path(folder)):
                 new_win = self.get_window(add_to)
                 if self.window.project_data() and add_to:
                     win_folders = self.window.project_data().get('folders', [])
@@ -510,7 +2510,10 @@ class OpenFolderHistoryCommand(sublime_plugin.WindowCommand):
                 new_win.set_sidebar_visible(True)
 
     def run(self, add_to_project=False):
-        self.conf.load_items_data()
+        self.conf.load_items_data(lambda: self.show_panel(add_to_project))
+
+    @instruments.timed('open_folder_history')
+    def show_panel(self, add_to_project):
         self.conf.set_display_list()
         placeholder = "Open Recent folder (out of {})".format(
             self.conf.items_count)
@@ -551,7 +2554,8 @@ class OpenFileHistoryCommand(sublime_plugin.WindowCommand):
     def show_preview(self, index):
         if index >= 0 and settings.get('show_file_preview'):
             file = self.conf.items[index]
-            if os.path.isfile(os.path.expanduser(file)):
+            instruments.count('ui thread stat')
+            if os.path.isfile(expand_path(file)):
                 self.window.open_file(file, sublime.TRANSIENT)
 
     def open_file(self, index):
@@ -561,7 +2565,8 @@ class OpenFileHistoryCommand(sublime_plugin.WindowCommand):
                 active_view.close()
             file = self.conf.items[index]
             self.conf.update_cache(last_selection=file)
-            if os.path.isfile(os.path.expanduser(file)):
+            instruments.count('ui thread stat')
+            if os.path.isfile(expand_path(file)):
                 new_win = self.get_window()
                 # new_win.set_sidebar_visible(True)
                 new_win.open_file(file)
@@ -571,13 +2576,16 @@ class OpenFileHistoryCommand(sublime_plugin.WindowCommand):
                 active_view.close()
 
     def run(self):
-        self.conf.load_items_data()
+        self.conf.load_items_data(self.show_panel)
+
+    @instruments.timed('open_file_history')
+    def show_panel(self):
         self.conf.set_display_list()
         placeholder = "Open Recent file (out of {})".format(
             self.conf.items_count)
         if len(self.conf.display_list) > 0:
-            self.window.show_quick_panel(
-                self.conf.display_list,
+            show_paged_panel(
+                self.window, self.conf.display_list,
                 self.open_file, placeholder=placeholder,
                 selected_index=self.conf.cache['last_index'],
                 on_highlight=self.show_preview)
@@ -585,10 +2593,397 @@ class OpenFileHistoryCommand(sublime_plugin.WindowCommand):
             self.window.show_quick_panel(["No history found"], None)
 
 
+class TrigramIndex():
+    """
+    Index of every known path, from the recent files and folders and from
+    Sublime's session histories, for open_recent_search.
+
+    Paths are split into their lowercased components (directory and file
+    names), which are shared by many paths. Components are indexed by their
+    trigrams, and each one maps to the paths containing it. A query word
+    thus only checks the components sharing all of its trigrams, and only
+    the paths holding a matching component are checked against the whole
+    query.
+
+    It is built on the first search, then kept up to date by the histories'
+    on_change callbacks and by the session cache.
+    """
+
+    SOURCES = {'folders': 1, 'files': 2, 'session_folders': 4,
+               'session_files': 8}
+    FOLDER_SOURCES = 1 | 4
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.built = False
+        # source -> history it is attached to
+        self.histories = {}
+        self.session_paths = {'session_folders': set(), 'session_files': set()}
+        self.ids = {}
+        self.paths = []
+        self.free_ids = []
+        # path -> bitmask of the SOURCES holding it
+        self.sources = {}
+        # component -> set of path ids
+        self.components = {}
+        # trigram -> list of components, lists being far smaller than sets
+        self.trigrams = {}
+
+    @staticmethod
+    def split(path):
+        return set(filter(None, re.split(r'[/\\]', path.lower())))
+
+    @staticmethod
+    def trigrams_of(text):
+        return set(text[i:i + 3] for i in range(len(text) - 2))
+
+    def attach(self, source, hist):
+        hist.on_change = lambda op, path: self.on_change(source, op, path)
+        with self.lock:
+            self.histories[source] = hist
+            if self.built:
+                self.sync(source, set(hist))
+
+    def on_change(self, source, op, path):
+        if not self.built:
+            return
+        if op == 'add':
+            self.add(path, source)
+        else:
+            self.remove(path, source)
+
+    def sync_session(self, data):
+        for source, type in (('session_folders', 'folders'),
+                             ('session_files', 'files')):
+            paths = ConfSublHist(type).get_session_data(data)
+            self.session_paths[source] = set(map(prettify_path, paths))
+            if self.built:
+                self.sync(source, self.session_paths[source])
+
+    def sync(self, source, paths):
+        """Makes source hold paths, only indexing the differences."""
+        with self.lock:
+            bit = self.SOURCES[source]
+            current = set(path for path, sources in self.sources.items()
+                          if sources & bit)
+            for path in current - paths:
+                self.remove(path, source)
+            for path in paths - current:
+                self.add(path, source)
+
+    def build(self):
+        # called on every search and preview: don't wait on the locks,
+        # which a flush holds while encoding the history, once built
+        if self.built:
+            return
+        # the histories' changes are only indexed once built, so they must
+        # not change meanwhile; history_lock is always taken first
+        with history_lock, self.lock:
+            if self.built:
+                return
+            start = time.perf_counter()
+            for source, hist in self.histories.items():
+                for path in hist:
+                    self.add(path, source)
+            for source, paths in self.session_paths.items():
+                for path in paths:
+                    self.add(path, source)
+            self.built = True
+            debug(None, 'Indexed %d paths in %.1f ms' % (
+                len(self.ids), (time.perf_counter() - start) * 1000))
+
+    def add(self, path, source):
+        with self.lock:
+            sources = self.sources.get(path)
+            self.sources[path] = (sources or 0) | self.SOURCES[source]
+            if sources is not None:
+                return
+            if self.free_ids:
+                path_id = self.free_ids.pop()
+                self.paths[path_id] = path
+            else:
+                path_id = len(self.paths)
+                self.paths.append(path)
+            self.ids[path] = path_id
+            for component in self.split(path):
+                ids = self.components.get(component)
+                if ids is None:
+                    ids = self.components[component] = set()
+                    for trigram in self.trigrams_of(component):
+                        self.trigrams.setdefault(trigram, []).append(component)
+                ids.add(path_id)
+
+    def remove(self, path, source):
+        with self.lock:
+            sources = self.sources.get(path)
+            if sources is None:
+                return
+            sources &= ~self.SOURCES[source]
+            if sources:
+                self.sources[path] = sources
+                return
+            del self.sources[path]
+            path_id = self.ids.pop(path)
+            self.paths[path_id] = None
+            self.free_ids.append(path_id)
+            for component in self.split(path):
+                ids = self.components[component]
+                ids.discard(path_id)
+                if ids:
+                    continue
+                del self.components[component]
+                for trigram in self.trigrams_of(component):
+                    components = self.trigrams[trigram]
+                    components.remove(component)
+                    if not components:
+                        del self.trigrams[trigram]
+
+    def is_folder(self, path):
+        return bool(self.sources.get(path, 0) & self.FOLDER_SOURCES)
+
+    def _word_ids(self, word):
+        """Returns the ids of the paths with a component matching word."""
+        # words spanning several components are checked later as a whole
+        part = max(re.split(r'[/\\]', word), key=len)
+        if len(part) >= 3:
+            postings = sorted((self.trigrams.get(trigram, [])
+                               for trigram in self.trigrams_of(part)),
+                              key=len)
+            components = set(postings[0]).intersection(*postings[1:])
+        else:
+            components = self.components
+        ids = set()
+        for component in components:
+            if part in component:
+                ids |= self.components[component]
+        return ids
+
+    def search(self, query, limit=100):
+        """
+        Returns up to limit paths containing every word of query, those
+        matching in their basename and shorter ones first.
+        """
+        self.build()
+        words = query.lower().split()
+        if not words:
+            return []
+        with self.lock:
+            candidates = None
+            for word in sorted(words, key=len, reverse=True):
+                ids = self._word_ids(word)
+                candidates = ids if candidates is None else candidates & ids
+                if not candidates:
+                    return []
+            matches = []
+            for path_id in candidates:
+                path = self.paths[path_id]
+                lower = path.lower()
+                if all(word in lower for word in words):
+                    matches.append(path)
+
+        def rank(path):
+            name = os.path.basename(path.lower().rstrip('/\\'))
+            return (-sum(word in name for word in words), len(path), path)
+
+        return heapq.nsmallest(limit, matches, key=rank)
+
+
+search_index = TrigramIndex()
+
+
+class MergedFileHistory():
+    """
+    The recent files merged with Sublime's file history, newest first and
+    without duplicates, for open_recent_files when `merge_session_history`
+    is set. Paths are deduplicated by their expanded, case-normalized form
+    through a set, and the two time-ordered lists are merged in one pass:
+    session entries have no times of their own, so they all take the
+    session file's mtime. With `sort_order` "frecency", the own paths come
+    by frecency instead, followed by the session's other files, which have
+    no score. The result is cached until either list changes.
+    """
+
+    def __init__(self):
+        self.key = None
+        self.paths = []
+        self.items = []
+
+    def get(self):
+        """Returns the merged paths and their quick panel items."""
+        two_lines = bool(settings.get('display_two_lines'))
+        frecency = settings.get('sort_order') == 'frecency'
+        key = (id(files_hist), files_hist.version, session_cache.key,
+               two_lines, frecency)
+        if key != self.key:
+            self.paths = self.merge(frecency)
+            if two_lines:
+                # shares the items of open_recent_files' own panel
+                cached = files_panel.two_line_items
+                self.items = [cached.get(f) or
+                              [os.path.basename(f), os.path.dirname(f)]
+                              for f in self.paths]
+            else:
+                self.items = self.paths
+            self.key = key
+        return self.paths, self.items
+
+    def merge(self, frecency=False):
+        with history_lock:
+            own = files_hist.entries_newest_first()
+            ranked = files_hist.ranked() if frecency else None
+        session_time = session_cache.key[1] if session_cache.key else 0
+        session = []
+        if session_cache.data is not None:
+            session = ConfSublHist('files').get_session_data(
+                session_cache.data)
+
+        if frecency:
+            merged = list(ranked)
+            seen = {os.path.normcase(full) for path, full, last in own}
+            for full in session:
+                normalized = os.path.normcase(full)
+                if normalized not in seen:
+                    seen.add(normalized)
+                    merged.append(prettify_path(full))
+            return merged
+
+        # own paths touched after the session was saved come first, then
+        # the session's, then the older own paths
+        split = 0
+        while split < len(own) and own[split][2] >= session_time:
+            split += 1
+        merged = [path for path, full, last in own[:split]]
+        seen = {os.path.normcase(full) for path, full, last in own[:split]}
+        session_seen = set()
+        for full in session:
+            normalized = os.path.normcase(full)
+            if normalized not in seen and normalized not in session_seen:
+                session_seen.add(normalized)
+                merged.append(prettify_path(full))
+        if session_seen:
+            merged.extend(path for path, full, last in own[split:]
+                          if os.path.normcase(full) not in session_seen)
+        else:
+            merged.extend(path for path, full, last in own[split:])
+        return merged
+
+
+merged_files = MergedFileHistory()
+
+
+class SearchQueryInputHandler(sublime_plugin.TextInputHandler):
+    def name(self):
+        return 'query'
+
+    def placeholder(self):
+        return 'Search recent files and folders'
+
+    def preview(self, text):
+        if not text.strip():
+            return None
+        if not search_index.built:
+            # OpenRecentSearchCommand.input builds it on the async thread
+            return 'Indexing recent files and folders...'
+        start = time.perf_counter()
+        matches = search_index.search(text, 5)
+        elapsed = (time.perf_counter() - start) * 1000
+        if not matches:
+            return 'No matches ({:.1f} ms)'.format(elapsed)
+        return '{} ({:.1f} ms)'.format(
+            ' | '.join(map(os.path.basename, matches)), elapsed)
+
+
+class OpenRecentStatsCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        report = instruments.report()
+        print(report)
+        panel = self.window.create_output_panel('open_recent_stats')
+        panel.run_command('append', {'characters': report})
+        self.window.run_command(
+            'show_panel', {'panel': 'output.open_recent_stats'})
+
+
+class OpenRecentSearchCommand(sublime_plugin.WindowCommand):
+    def __init__(self, window):
+        super().__init__(window)
+        self.results = []
+
+    def input(self, args):
+        if 'query' not in args:
+            sublime.set_timeout_async(self.build_index, 0)
+            return SearchQueryInputHandler()
+
+    @staticmethod
+    def build_index():
+        history_loader.ensure_loaded()
+        search_index.build()
+
+    def on_selected(self, index):
+        if index < 0:
+            return
+        path = self.results[index]
+        full = expand_path(path)
+        instruments.count('ui thread stat')
+        if search_index.is_folder(path):
+            if os.path.isdir(full):
+                self.window.run_command('new_window')
+                new_win = sublime.active_window()
+                new_win.set_project_data({'folders': [{'path': full}]})
+                new_win.set_sidebar_visible(True)
+        elif os.path.isfile(full):
+            self.window.open_file(full)
+
+    @instruments.timed('open_recent_search')
+    def run(self, query):
+        history_loader.ensure_loaded()
+        self.results = search_index.search(query)
+        placeholder = 'Matches for "{}" (out of {})'.format(
+            query, len(self.results))
+        if self.results:
+            if settings.get('display_two_lines'):
+                items = [[os.path.basename(f), os.path.dirname(f)]
+                         for f in self.results]
+            else:
+                items = self.results
+            self.window.show_quick_panel(
+                items, self.on_selected, placeholder=placeholder)
+        else:
+            self.window.show_quick_panel(["No matches found"], None)
+
+
 class ViewSettings():
-    def __init__(self, view) -> None:
+    def __init__(self, view, settings=None) -> None:
         self.view = view
-        self.settings = self._saveSettings()
+        self.settings = settings or self._saveSettings()
+
+    def pack(self):
+        """
+        Returns the settings as one string of integers, to keep them small in
+        folders_info: the viewport, the number of selections, then the start
+        and end of each selection and bookmark.
+        """
+        selections = self.settings['selections'][:MAX_PACKED_REGIONS]
+        bookmarks = self.settings['bookmarks'][:MAX_PACKED_REGIONS]
+        values = [int(v) for v in self.settings['viewport']]
+        values.append(len(selections))
+        for region in selections + bookmarks:
+            values += [region.a, region.b]
+        return ','.join(map(str, values))
+
+    @classmethod
+    def unpack(cls, packed):
+        try:
+            values = [int(v) for v in packed.split(',')]
+            count = values[2]
+        except (AttributeError, ValueError, IndexError):
+            return None
+        regions = [sublime.Region(values[i], values[i + 1])
+                   for i in range(3, len(values) - 1, 2)]
+        return cls(None, {
+            'bookmarks': regions[count:],
+            'selections': regions[:count],
+            'viewport': (values[0], values[1])
+        })
 
     def _bookmarks(self):
         return self.view.get_regions('bookmarks')
@@ -604,49 +2999,197 @@ class ViewSettings():
         }
 
     def copyTo(self, other_view):
-        if other_view.is_loading():
-            sublime.set_timeout(lambda: self.copyTo(other_view), 0)
-        else:
-            # Bookmarks
-            other_view.add_regions(
-                'bookmarks',
-                self.settings['bookmarks'],
-                'bookmarks', 'bookmark',
-                sublime.HIDDEN | sublime.PERSISTENT)
+        pending_restores.add(other_view, self)
 
-            # Selections
-            other_view.sel().clear()
-            for region in self.settings['selections']:
-                other_view.sel().add(region)
+    def apply(self, other_view):
+        # Bookmarks
+        other_view.add_regions(
+            'bookmarks',
+            self.settings['bookmarks'],
+            'bookmarks', 'bookmark',
+            sublime.HIDDEN | sublime.PERSISTENT)
 
-            # Scroll the viewport to given layout position
-            other_view.set_viewport_position(self.settings['viewport'])
+        # Selections
+        other_view.sel().clear()
+        for region in self.settings['selections']:
+            other_view.sel().add(region)
 
+        # Scroll the viewport to given layout position
+        other_view.set_viewport_position(self.settings['viewport'])
 
-class MoveToNewWindowCommand(sublime_plugin.WindowCommand):
-    def run(self):
-        tab = self.window.active_view()
-        tab_settings = ViewSettings(tab)
-        file = tab.file_name()
-        if tab.is_dirty() or tab.is_scratch():
+
+class PendingRestores():
+    """
+    ViewSettings waiting for their views to finish loading. They are applied
+    by PendingRestoreListener when the view is loaded, instead of polling
+    is_loading(), so any number of views can be restored at once.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def add(self, view, view_settings):
+        with self.lock:
+            self.pending[view.id()] = view_settings
+        # the view may have finished loading before it was registered
+        if not view.is_loading():
+            self.loaded(view)
+
+    def loaded(self, view):
+        with self.lock:
+            view_settings = self.pending.pop(view.id(), None)
+        if view_settings:
+            view_settings.apply(view)
+
+    def discard(self, view):
+        with self.lock:
+            self.pending.pop(view.id(), None)
+
+
+pending_restores = PendingRestores()
+
+
+class PendingRestoreListener(sublime_plugin.EventListener):
+    def on_load(self, view):
+        pending_restores.loaded(view)
+
+    def on_close(self, view):
+        pending_restores.discard(view)
+
+
+def tabs_to_move(window, tabs):
+    """
+    Returns the views moved by the move commands: the active tab, all tabs
+    of the active group ("group"), or the selected tabs ("selected").
+    """
+    if tabs == 'group':
+        views = window.views_in_group(window.active_group())
+    elif tabs == 'selected' and hasattr(window, 'selected_sheets'):
+        views = [sheet.view() for sheet in window.selected_sheets()]
+    else:
+        views = [window.active_view()]
+    return [view for view in views if view]
+
+
+def can_move(views):
+    for view in views:
+        if view.is_dirty() or view.is_scratch() or not view.file_name():
             sublime.message_dialog('You need to save your changes first!')
+            return False
+    return True
+
+
+def move_views(views, target_win):
+    """
+    Moves the views to target_win: their settings are captured in one pass,
+    the files reopened in one go, and the settings restored as each view
+    finishes loading.
+    """
+    moved = [(view.file_name(), ViewSettings(view)) for view in views]
+    for view in views:
+        view.close()
+    for file, tab_settings in moved:
+        tab_settings.copyTo(target_win.open_file(file))
+
+
+class MoveToNewWindowCommand(sublime_plugin.WindowCommand):
+    @instruments.timed('move_to_new_window')
+    def run(self, tabs='active'):
+        views = tabs_to_move(self.window, tabs)
+        if not views or not can_move(views):
             return
-        tab.close()
         self.window.run_command('new_window')
         new_win = sublime.active_window()
         # new_win.set_sidebar_visible(True)
-        new_view = new_win.open_file(file)
-        tab_settings.copyTo(new_view)
+        move_views(views, new_win)
+
+
+class WindowIndex():
+    """
+    The quick panel labels of the open windows for move_to_window, kept
+    between runs. WindowIndexListener drops the label of a window whenever
+    one of its tabs is opened, saved, closed or moved to another window,
+    so only those windows are walked again. Joined labels are cut after
+    LABEL_LENGTH characters.
+    """
+    LABEL_LENGTH = 200
+
+    def __init__(self):
+        self.labels = {}
+        self.view_windows = {}
+
+    @staticmethod
+    def view_name(view):
+        file_name = view.file_name()
+        if file_name:
+            return os.path.basename(file_name)
+        return view.name() or 'untitled'
+
+    def label(self, window):
+        label = self.labels.get(window.id())
+        if label is None:
+            names = []
+            length = 0
+            for view in window.views():
+                self.view_windows[view.id()] = window.id()
+                if length <= self.LABEL_LENGTH:
+                    names.append(self.view_name(view))
+                    length += len(names[-1]) + 3
+            if names:
+                joined = " | ".join(names)
+                if len(joined) > self.LABEL_LENGTH:
+                    joined = joined[:self.LABEL_LENGTH - 3] + '...'
+                label = [names[0], joined]
+            else:
+                label = ['Empty Window', '--']
+            self.labels[window.id()] = label
+        return label
+
+    def view_changed(self, view):
+        self.view_closed(view)
+        window = view.window()
+        if window:
+            self.view_windows[view.id()] = window.id()
+            self.labels.pop(window.id(), None)
+
+    def view_activated(self, view):
+        window = view.window()
+        if window and self.view_windows.get(view.id()) != window.id():
+            self.view_changed(view)
+
+    def view_closed(self, view):
+        window_id = self.view_windows.pop(view.id(), None)
+        self.labels.pop(window_id, None)
+
+    def window_closed(self, window):
+        self.labels.pop(window.id(), None)
+
+
+window_index = WindowIndex()
+
+
+class WindowIndexListener(sublime_plugin.EventListener):
+    def on_new(self, view):
+        window_index.view_changed(view)
+
+    def on_load(self, view):
+        window_index.view_changed(view)
+
+    def on_post_save(self, view):
+        window_index.view_changed(view)
+
+    def on_activated(self, view):
+        window_index.view_activated(view)
+
+    def on_close(self, view):
+        window_index.view_closed(view)
 
 
 class MoveToWindowCommand(sublime_plugin.WindowCommand):
     wins_list = []
     display_list = []
 
-    @staticmethod
-    def get_file_name(path):
-        return os.path.basename(path)
-
     def clear_lists(self):
         self.wins_list = []
         self.display_list = []
@@ -659,42 +3202,29 @@ class MoveToWindowCommand(sublime_plugin.WindowCommand):
 
     def set_wins(self):
         self.wins_list = sublime.windows()
-        for win in self.wins_list:
-            win_files = []
-            views = win.views()
-            for view in views:
-                win_files.append(self.get_file_name(view.file_name()))
-
-            if win_files:
-                display_item = []
-                display_item.append(win_files[0])
-                display_item.append(" | ".join(win_files))
-                self.display_list.append(display_item)
-            else:
-                self.display_list.append(['Empty Window', '--'])
+        self.display_list = [window_index.label(win)
+                             for win in self.wins_list]
 
     def on_open(self, index):
-        tab = self.window.active_view()
-        tab_settings = ViewSettings(tab)
-        if tab.is_dirty() or tab.is_scratch():
-            sublime.message_dialog('You need to save your changes first!')
-            return
         if index >= 0:
             current_win = sublime.active_window()
             selected_win = self.wins_list[index]
             if current_win != selected_win:
-                file = tab.file_name()
-                tab.close()
+                if not can_move(self.views):
+                    return
                 # selected_win.set_sidebar_visible(True)
-                new_view = selected_win.open_file(file)
-                tab_settings.copyTo(new_view)
+                move_views(self.views, selected_win)
 
                 selected_win.bring_to_front()
 
             if self.win_is_empty(current_win):
                 current_win.run_command('close_window')
 
-    def run(self):
+    @instruments.timed('move_to_window')
+    def run(self, tabs='active'):
+        self.views = tabs_to_move(self.window, tabs)
+        if not self.views:
+            return
         self.clear_lists()
         self.set_wins()
         placeholder = 'Select window (out of {})'.format(len(self.wins_list))